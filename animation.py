@@ -0,0 +1,46 @@
+from typing import Dict, List, Tuple
+
+import pyxel
+
+from constants import GRID_CELL_SIZE
+
+# Frame lists seen at once before the table cache starts over, copies come from unpickled games
+MAX_FRAME_TABLES = 256
+
+# Cell -> phase offset in frames of animations playing in it, so neighbours don't animate in lockstep
+phases: Dict[Tuple[int, int], float] = {}
+# id of an animated sprite's frame list -> the list and its frame per tick of one loop, by anim speed
+frame_tables: Dict[int, Tuple[list, Dict[int, list]]] = {}
+
+
+def get_phase(cell: Tuple[int, int]) -> float:
+    phase = phases.get(cell)
+    if phase is None:
+        phase = 10*pyxel.noise(cell[0]*GRID_CELL_SIZE/10, cell[1]*GRID_CELL_SIZE/10)
+        phases[cell] = phase
+    return phase
+
+
+def get_frame_table(frames: list, anim_speed: int) -> List[Tuple[int, int]]:
+    entry = frame_tables.get(id(frames))
+    # Holding on to the list keeps its id from being reused by another one
+    if entry is None or entry[0] is not frames:
+        if len(frame_tables) >= MAX_FRAME_TABLES:
+            frame_tables.clear()
+        entry = frames, {}
+        frame_tables[id(frames)] = entry
+    table = entry[1].get(anim_speed)
+    if table is None:
+        table = [frames[(tick // anim_speed) % len(frames)] for tick in range(anim_speed*len(frames))]
+        entry[1][anim_speed] = table
+    return table
+
+
+def get_frame(frames: list, anim_speed: int, ticks: float, cell: Tuple[int, int]) -> Tuple[int, int]:
+    """ Frame shown ticks frames into the animation of an object standing in cell"""
+    t = ticks + get_phase(cell)
+    if t < 0:
+        # Tables start at 0, before that int() rounds towards zero
+        return frames[int(t / anim_speed) % len(frames)]
+    table = get_frame_table(frames, anim_speed)
+    return table[int(t) % len(table)]
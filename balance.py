@@ -0,0 +1,252 @@
+import abc
+import argparse
+import importlib
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import constants
+import headless
+from flow_field import UNREACHABLE
+
+# python balance.py --runs 2000 --policy greedy --waves 90,90,120,180,120 --wave-count 5,10,15,20,20
+
+
+def cell_of(draw_pos) -> Tuple[int, int]:
+    return int(draw_pos[0] / constants.GRID_CELL_SIZE), int(draw_pos[1] / constants.GRID_CELL_SIZE)
+
+
+class Policy(abc.ABC):
+    """ Plays a headless game, act() is called every frame and sends the input for one decision"""
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+
+    @abc.abstractmethod
+    def act(self, sim: headless.Simulation) -> None:
+        pass
+
+    #
+    # Clicks on the same areas update_ui() checks
+    #
+    @staticmethod
+    def click_cell(sim: headless.Simulation, draw_pos) -> None:
+        sim.click(int(draw_pos[0]) + 8, int(draw_pos[1]) + 8)
+
+    @staticmethod
+    def click_action(sim: headless.Simulation, die) -> None:
+        for button_die, x, y in sim.main.get_action_buttons():
+            if button_die == die:
+                sim.click(x + 5, y + 2)
+
+    @staticmethod
+    def click_die(sim: headless.Simulation, i: int) -> None:
+        x, y = sim.main.get_dice_positions()[i]
+        sim.click(x + 6, y - 6)
+
+
+class RandomPolicy(Policy):
+    """ Takes any available action and picks moves at random"""
+    def act(self, sim: headless.Simulation) -> None:
+        g = sim.game
+        game = sim.main.game
+        if g.game_state == game.GameState.Tutorial:
+            if g.time_since_tutorial_step > 0.6:
+                sim.click(0, 0)
+            return
+
+        if g.action == game.Action.Roll:
+            dice = [d for d in [game.Dice.Shoot, game.Dice.Move, game.Dice.Reload] if g.can_do_die_action(d)]
+            if dice:
+                self.click_action(sim, self.random.choice(dice))
+            elif all(t <= 0 for t in g.dice_roll_timer):
+                if all(d == game.Dice.Stuck for d in g.dice):
+                    x, y = sim.main.get_unstuck_button()
+                    sim.click(x + 5, y + 2)
+                else:
+                    self.click_die(sim, self.random.choice([i for i in range(len(g.dice)) if g.can_roll(i)]))
+        elif g.action == game.Action.MovePlayer:
+            options = sim.main.get_player_move_options()
+            if options:
+                self.click_cell(sim, self.random.choice(options)[2])
+        elif g.action == game.Action.MoveEnemy:
+            self.move_enemy(sim)
+        elif g.action == game.Action.Shoot:
+            sim.click(sim.pyxel.mouse_x, sim.pyxel.mouse_y)
+        elif g.action == game.Action.NewWave:
+            spawns = g.get_objs_of_type(sim.main.ObjType.Spawn)
+            self.click_cell(sim, self.random.choice(spawns).get_pos())
+        elif g.action == game.Action.Break:
+            x, y = sim.main.get_next_wave_button()
+            sim.click(x + 16, y + 2)
+
+    def move_enemy(self, sim: headless.Simulation) -> None:
+        g = sim.game
+        if g.selected_enemy is None:
+            enemies = g.get_objs_of_type(sim.main.ObjType.Enemy)
+            if enemies:
+                self.click_cell(sim, self.random.choice(enemies).get_pos())
+        else:
+            options = sim.main.get_enemy_move_options(g.selected_enemy)
+            if options:
+                self.click_cell(sim, self.random.choice(options)[1])
+
+
+class GreedyPolicy(RandomPolicy):
+    """ Shoots whenever it can, aims at the closest enemy, walks to pickups and walks enemies the long way round"""
+    def act(self, sim: headless.Simulation) -> None:
+        g = sim.game
+        game = sim.main.game
+        if g.game_state == game.GameState.Game and g.action == game.Action.Roll:
+            player = g.player_obj
+            if player.ammo == 0 and g.can_do_die_action(game.Dice.Reload):
+                self.click_action(sim, game.Dice.Reload)
+                return
+            if player.ammo > 0 and g.can_do_die_action(game.Dice.Shoot):
+                self.click_action(sim, game.Dice.Shoot)
+                return
+        if g.action == game.Action.Shoot:
+            enemies = g.get_objs_of_type(sim.main.ObjType.Enemy, sim.main.ObjType.EnemyBig)
+            if enemies:
+                target = min(enemies, key=lambda obj: sim.main.game_object.get_dist_obj(g.player_obj, obj))
+                sim.click(*target.get_pos_mid())
+                return
+        if g.action == game.Action.MovePlayer and self.move_to_pickup(sim):
+            return
+        super().act(sim)
+
+    def move_to_pickup(self, sim: headless.Simulation) -> bool:
+        """ Steps towards the closest pickup by path, False when there's none to go for"""
+        room = sim.main.room
+        pickups = sim.game.get_objs_of_type(sim.main.ObjType.Shotgun, sim.main.ObjType.Speed, sim.main.ObjType.Health)
+        options = sim.main.get_player_move_options()
+        dists = []
+        for x, y, draw_pos in options:
+            cell = cell_of(draw_pos)
+            reachable = [d for d in (room.get_path_dist_to(obj, cell) for obj in pickups) if d != UNREACHABLE]
+            if reachable:
+                dists.append((min(reachable), draw_pos))
+        if not dists:
+            return False
+        self.click_cell(sim, min(dists, key=lambda d: d[0])[1])
+        return True
+
+    def move_enemy(self, sim: headless.Simulation) -> None:
+        g = sim.game
+        if g.selected_enemy is not None:
+            options = sim.main.get_enemy_move_options(g.selected_enemy)
+            # Stay as far from the burger as allowed and don't walk into the player
+            options = [o for o in options if o[2] is None or o[2].obj_type != sim.main.ObjType.Target] or options
+            if options:
+                # Of the moves furthest from the burger, the one furthest from the player
+                best = max(options, key=lambda o: (sim.game.get_path_dist(sim.main.game.PATH_FIELD_BURGER, cell_of(o[1])),
+                                                   sim.main.room.get_path_dist_to(g.player_obj, cell_of(o[1]))))
+                self.click_cell(sim, best[1])
+                return
+        super().move_enemy(sim)
+
+
+POLICIES = {
+    "random": RandomPolicy,
+    "greedy": GreedyPolicy,
+}
+
+
+def get_policy(name: str):
+    """ Registered name, or module:Class for policies living elsewhere"""
+    if name in POLICIES:
+        return POLICIES[name]
+    module, attr = name.split(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def run_game(seed: int, policy_name: str, max_frames: int, params: Dict[str, List[int]]) -> Dict:
+    # Balance values are read from constants when they're used, not copied at import
+    for key, value in params.items():
+        setattr(constants, key, value)
+    sim = headless.Simulation(seed)
+    policy = get_policy(policy_name)(seed)
+    while sim.game.game_state != sim.main.game.GameState.GameOver and sim.pyxel.frame_count < max_frames:
+        policy.act(sim)
+        sim.step()
+    return {
+        "seed": seed,
+        "wave": sim.game.current_wave,
+        "enemies_killed": sim.game.enemies_killed,
+        "total_time": sim.game.total_time,
+        "frames": sim.pyxel.frame_count,
+        "game_over": sim.game.game_state == sim.main.game.GameState.GameOver,
+    }
+
+
+class BalanceReport:
+    """ Running totals of the finished runs, so results can be shown while the batch is still going"""
+    METRICS = ["wave", "enemies_killed", "total_time"]
+
+    def __init__(self):
+        self.runs = 0
+        self.game_overs = 0
+        self.totals = {m: 0.0 for m in self.METRICS}
+        self.mins = {m: None for m in self.METRICS}
+        self.maxs = {m: None for m in self.METRICS}
+        self.wave_histogram: Dict[int, int] = {}
+
+    def add(self, result: Dict) -> None:
+        self.runs += 1
+        self.game_overs += result["game_over"]
+        for m in self.METRICS:
+            val = result[m]
+            self.totals[m] += val
+            self.mins[m] = val if self.mins[m] is None else min(self.mins[m], val)
+            self.maxs[m] = val if self.maxs[m] is None else max(self.maxs[m], val)
+        self.wave_histogram[result["wave"]] = self.wave_histogram.get(result["wave"], 0) + 1
+
+    def __str__(self):
+        lines = [f"Runs: {self.runs}  Game overs: {self.game_overs}"]
+        for m in self.METRICS:
+            if self.runs > 0:
+                lines.append(f"  {m}: mean {self.totals[m]/self.runs:.2f}  min {self.mins[m]}  max {self.maxs[m]}")
+        lines.append("  Waves reached: " + ", ".join(f"{w}: {n}" for w, n in sorted(self.wave_histogram.items())))
+        return "\n".join(lines)
+
+
+def run_batch(runs: int, policy_name: str = "greedy", max_frames: int = 30*60*10, params: Dict = None,
+              first_seed: int = 0, workers: Optional[int] = None, progress_every: int = 100) -> BalanceReport:
+    params = params or {}
+    report = BalanceReport()
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_game, seed, policy_name, max_frames, params) for seed in range(first_seed, first_seed + runs)]
+        for future in as_completed(futures):
+            report.add(future.result())
+            if progress_every and report.runs % progress_every == 0:
+                print(f"[{time.perf_counter() - start_time:.0f}s]\n{report}", flush=True)
+    return report
+
+
+def parse_int_list(text: str) -> List[int]:
+    return [int(v) for v in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays seeded headless games in parallel and reports how far they got")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--policy", default="greedy", help="random, greedy or module:Class")
+    parser.add_argument("--max-frames", type=int, default=30*60*10)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--waves", type=parse_int_list, help="Override constants.WAVES")
+    parser.add_argument("--wave-count", type=parse_int_list, help="Override constants.WAVE_COUNT")
+    parser.add_argument("--dice", type=parse_int_list, help="Override constants.DICE_ROLL_BOUNDS")
+    args = parser.parse_args()
+
+    params = {}
+    if args.waves:
+        params["WAVES"] = args.waves
+    if args.wave_count:
+        params["WAVE_COUNT"] = args.wave_count
+    if args.dice:
+        params["DICE_ROLL_BOUNDS"] = args.dice
+    report = run_batch(args.runs, args.policy, args.max_frames, params, args.first_seed, args.workers)
+    print(report)
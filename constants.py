@@ -15,12 +15,42 @@ ROOM_SIZE_Y: int = int(SCREEN_HEIGHT/GRID_CELL_SIZE - UI_SIZE/GRID_CELL_SIZE)
 ROOM_SIZE_PIXELS_X: int = int(SCREEN_WIDTH)
 ROOM_SIZE_PIXELS_Y: int = int(SCREEN_HEIGHT) - UI_SIZE
 
+# Size of the whole level tilemap
+MAP_SIZE_X: int = 64
+MAP_SIZE_Y: int = 64
+
 DEBUG_DRAW: bool = False
 
+# Removed bullets and corpses kept around to be reused for new objects
+OBJ_POOL_SIZE: int = 32
+
+RESOURCE_FILE: str = "assets/my_resource.pyxres"
+# Compiled levels are kept here (relative to the game directory), keyed by a hash of the resource file. Empty disables the cache
+LEVEL_CACHE_DIR: str = "level_cache"
+
+# Input log of the session is written here when set, to reproduce a run frame by frame
+RECORD_INPUT_FILE: str = ""
+# Input log to play back instead of live input, the run uses the seed it was recorded with
+REPLAY_INPUT_FILE: str = ""
+# Updates per displayed frame while replaying
+REPLAY_SPEED: int = 1
+# Recorded runs store the game state this often, seeking restores the nearest one
+KEYFRAME_INTERVAL: int = FPS*10
+
+# Game is saved here on exit and resumed from it on the next start when set
+SAVE_FILE: str = ""
+
+# Right click takes back the last action, for trying out balance changes
+ALLOW_UNDO: bool = False
+# Actions kept for undoing, older ones are dropped
+UNDO_HISTORY: int = 32
+
 # Time per wave
 WAVES = [90, 90, 120, 180, 120]
 # Enemies per wave
 WAVE_COUNT = [5, 10, 15, 20, 20]
+# Die roll goes from 1 to the last bound, a roll at or below a bound gives that face: Move, Shoot, Reload, Enemy, Stuck
+DICE_ROLL_BOUNDS = [2, 6, 8, 9, 10]
 
 BULLET_SPEED = 20
 MOVE_ANIM_TIME = 0.6
\ No newline at end of file
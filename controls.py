@@ -1,25 +1,87 @@
+from typing import Iterator, NamedTuple, Optional
+
 import pyxel
 
 import resources
 
 
+class InputFrame(NamedTuple):
+    """ Input state of one update, keys are bitmasks over TRACKED_KEYS"""
+    mouse_x: int
+    mouse_y: int
+    held: int
+    pressed: int
+
+
+# Every key or button the game reads
+TRACKED_KEYS = [pyxel.MOUSE_BUTTON_LEFT, pyxel.MOUSE_BUTTON_RIGHT, pyxel.KEY_1, pyxel.KEY_2, pyxel.KEY_3,
+                pyxel.KEY_A, pyxel.KEY_LEFT, pyxel.GAMEPAD1_BUTTON_DPAD_LEFT,
+                pyxel.KEY_D, pyxel.KEY_RIGHT, pyxel.GAMEPAD1_BUTTON_DPAD_RIGHT,
+                pyxel.KEY_W, pyxel.KEY_UP, pyxel.GAMEPAD1_BUTTON_DPAD_UP,
+                pyxel.KEY_S, pyxel.KEY_DOWN, pyxel.GAMEPAD1_BUTTON_DPAD_DOWN,
+                pyxel.KEY_Z, pyxel.KEY_J, pyxel.GAMEPAD1_BUTTON_A,
+                pyxel.KEY_X, pyxel.KEY_K, pyxel.GAMEPAD1_BUTTON_B]
+KEY_BITS = {key: 1 << i for i, key in enumerate(TRACKED_KEYS)}
+
+
 class Controls:
+    frame: InputFrame = InputFrame(0, 0, 0, 0)
+    playback: Optional[Iterator[InputFrame]] = None  # Replayed input, used instead of pyxel until it runs out
+    recorder = None  # Gets every sampled frame through add(frame)
+
+    @staticmethod
+    def begin_frame() -> None:
+        """ Samples input once per update, everything else reads that sample"""
+        frame = None
+        if Controls.playback is not None:
+            frame = next(Controls.playback, None)
+            if frame is None:
+                Controls.playback = None
+        if frame is None:
+            held = 0
+            pressed = 0
+            for key, bit in KEY_BITS.items():
+                if pyxel.btn(key):
+                    held |= bit
+                if pyxel.btnp(key):
+                    pressed |= bit
+            frame = InputFrame(pyxel.mouse_x, pyxel.mouse_y, held, pressed)
+        Controls.frame = frame
+        if Controls.recorder is not None:
+            Controls.recorder.add(frame)
+
+    @staticmethod
+    def btn(key) -> bool:
+        return Controls.frame.held & KEY_BITS[key] != 0
+
+    @staticmethod
+    def btnp(key) -> bool:
+        return Controls.frame.pressed & KEY_BITS[key] != 0
+
+    @staticmethod
+    def mouse_x() -> int:
+        return Controls.frame.mouse_x
+
+    @staticmethod
+    def mouse_y() -> int:
+        return Controls.frame.mouse_y
+
     @staticmethod
     def mouse_cancel(one=True):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.MOUSE_BUTTON_RIGHT)
     @staticmethod
     def mouse(one=True):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.MOUSE_BUTTON_LEFT)
 
     @staticmethod
     def mouse_hovering(x, y, width, height):
-        return x < pyxel.mouse_x < x + width and y < pyxel.mouse_y < y + height
+        return x < Controls.frame.mouse_x < x + width and y < Controls.frame.mouse_y < y + height
     @staticmethod
     def mouse_in(x, y, width, height, one=True):
         #pyxel.rectb(x, y, width, height, resources.COLOR_HIGHLIGHT)
@@ -31,53 +93,53 @@ class Controls:
     @staticmethod
     def key(val):
         if val == 0:
-            return pyxel.btnp(pyxel.KEY_1)
+            return Controls.btnp(pyxel.KEY_1)
         if val == 1:
-            return pyxel.btnp(pyxel.KEY_2)
+            return Controls.btnp(pyxel.KEY_2)
         if val == 2:
-            return pyxel.btnp(pyxel.KEY_3)
+            return Controls.btnp(pyxel.KEY_3)
         assert False
 
     @staticmethod
     def left(one=False):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.KEY_A) or f(pyxel.KEY_LEFT) or f(pyxel.GAMEPAD1_BUTTON_DPAD_LEFT)
 
     @staticmethod
     def right(one=False):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.KEY_D) or f(pyxel.KEY_RIGHT) or f(pyxel.GAMEPAD1_BUTTON_DPAD_RIGHT)
 
     @staticmethod
     def up(one=False):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.KEY_W) or f(pyxel.KEY_UP) or f(pyxel.GAMEPAD1_BUTTON_DPAD_UP)
 
     @staticmethod
     def down(one=False):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.KEY_S) or f(pyxel.KEY_DOWN) or f(pyxel.GAMEPAD1_BUTTON_DPAD_DOWN)
 
     @staticmethod
     def a(one=False):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.KEY_Z) or f(pyxel.KEY_J) or f(pyxel.GAMEPAD1_BUTTON_A)
 
     @staticmethod
     def b(one=False):
-        f = pyxel.btn
+        f = Controls.btn
         if one:
-            f = pyxel.btnp
+            f = Controls.btnp
         return f(pyxel.KEY_X) or f(pyxel.KEY_K) or f(pyxel.GAMEPAD1_BUTTON_B)
 
     @staticmethod
@@ -0,0 +1,135 @@
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+UNREACHABLE = -1
+
+
+def dilate(mask: np.ndarray) -> np.ndarray:
+    # 3x3 box is separable, so two 1D passes give the 8-neighbourhood
+    horizontal = mask.copy()
+    horizontal[1:, :] |= mask[:-1, :]
+    horizontal[:-1, :] |= mask[1:, :]
+    result = horizontal.copy()
+    result[:, 1:] |= horizontal[:, :-1]
+    result[:, :-1] |= horizontal[:, 1:]
+    return result
+
+
+class FlowField:
+    """
+    Number of 8-directional moves from every map cell to a source cell, indexed [x, y].
+    Cells that can't reach the source hold UNREACHABLE.
+    """
+    def __init__(self, size_x: int, size_y: int):
+        self.dist = np.full((size_x, size_y), UNREACHABLE, dtype=np.int32)
+        self.walkable = np.zeros((size_x, size_y), dtype=bool)
+        self.source = None
+        self.last_build_time = 0.0  # Shown in the debug overlay
+
+    def build(self, walkable: np.ndarray, source: Tuple[int, int]) -> None:
+        """ Source is reached even if it's not walkable itself (burger cell is occupied by the burger)"""
+        start_time = time.perf_counter()
+        self.walkable[:] = walkable
+        self.source = source
+        self.dist.fill(UNREACHABLE)
+        self.dist[source] = 0
+
+        # Whole frontier advances one level per iteration, no per-cell Python work
+        open_cells = walkable.copy()
+        open_cells[source] = False
+        frontier = np.zeros_like(open_cells)
+        frontier[source] = True
+        level = 0
+        while frontier.any():
+            level += 1
+            frontier = dilate(frontier) & open_cells
+            self.dist[frontier] = level
+            open_cells &= ~frontier
+        self.last_build_time = time.perf_counter() - start_time
+
+    def in_bounds(self, cell: Tuple[int, int]) -> bool:
+        return 0 <= cell[0] < self.dist.shape[0] and 0 <= cell[1] < self.dist.shape[1]
+
+    def get(self, cell: Tuple[int, int]) -> int:
+        if not self.in_bounds(cell):
+            return UNREACHABLE
+        return int(self.dist[cell])
+
+    def get_downhill_cells(self, cell: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """ Neighbours of the cell that are closer to the source"""
+        val = self.get(cell)
+        if val == UNREACHABLE:
+            return []
+        x0, y0 = max(cell[0]-1, 0), max(cell[1]-1, 0)
+        window = self.dist[x0:cell[0]+2, y0:cell[1]+2]
+        xs, ys = np.nonzero((window != UNREACHABLE) & (window < val))
+        return [(x0 + int(x), y0 + int(y)) for x, y in zip(xs, ys)]
+
+
+class FlowFieldCache:
+    """
+    Named flow fields sharing one walkability map, each rooted at its own target cell.
+    A field is rebuilt lazily after its target moves or the map changes.
+    """
+    def __init__(self, size_x: int, size_y: int):
+        self.size = (size_x, size_y)
+        self.walkable = np.zeros((size_x, size_y), dtype=bool)
+        self.ready = False  # Set once the map has been loaded
+        self.targets: Dict[str, Tuple[int, int]] = {}
+        self.fields: Dict[str, FlowField] = {}
+        self.dirty: Set[str] = set()
+
+    def set_map(self, walkable: np.ndarray) -> None:
+        self.walkable[:] = walkable
+        self.ready = True
+        self.dirty.update(self.fields.keys())
+
+    def set_walkable(self, cell: Tuple[int, int], walkable: bool) -> None:
+        if not (0 <= cell[0] < self.size[0] and 0 <= cell[1] < self.size[1]):
+            return
+        if self.walkable[cell] == walkable:
+            return
+        self.walkable[cell] = walkable
+        self.dirty.update(self.fields.keys())
+
+    def set_target(self, key: str, cell: Tuple[int, int]) -> None:
+        if self.targets.get(key) == cell:
+            return
+        self.targets[key] = cell
+        self.dirty.add(key)
+
+    def remove_target(self, key: str) -> None:
+        self.targets.pop(key, None)
+        self.fields.pop(key, None)
+        self.dirty.discard(key)
+
+    def set_field(self, key: str, dist: np.ndarray) -> None:
+        """ Takes a field built earlier for the current map and target, e.g. one loaded from disk"""
+        field = FlowField(*self.size)
+        field.dist[:] = dist
+        field.walkable[:] = self.walkable
+        field.source = self.targets[key]
+        self.fields[key] = field
+        self.dirty.discard(key)
+
+    def get_field(self, key: str) -> Optional[FlowField]:
+        if not self.ready or key not in self.targets:
+            return None
+        field = self.fields.get(key)
+        if field is None:
+            field = FlowField(*self.size)
+            self.fields[key] = field
+            self.dirty.add(key)
+        if key in self.dirty:
+            field.build(self.walkable, self.targets[key])
+            self.dirty.discard(key)
+        return field
+
+    def get_dist(self, key: str, cell: Tuple[int, int]) -> int:
+        field = self.get_field(key)
+        if field is None:
+            return UNREACHABLE
+        return field.get(cell)
+
@@ -1,11 +1,15 @@
-from typing import List, Tuple
+import heapq
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from enum import Enum
 
 import pyxel
 
 import constants
 import resources
-from game_object import Obj, ObjType
+import rng
+from game_object import ChangeLog, ColliderColumns, Obj, ObjType, obj_blocks_path
+from flow_field import FlowField, FlowFieldCache
+from tile_grid import TileGrid
 
 
 class GameState(Enum):
@@ -22,6 +26,9 @@ class Dice(Enum):
     Enemy = 4
     Stuck = 5
 
+# Same order as constants.DICE_ROLL_BOUNDS
+DICE_ROLL_FACES = [Dice.Move, Dice.Shoot, Dice.Reload, Dice.Enemy, Dice.Stuck]
+
 class Action(Enum):
     Roll = 0
     MovePlayer = 1
@@ -30,14 +37,51 @@ class Action(Enum):
     NewWave = 4
     Break = 5
 
+# Distance fields kept for these objects, pickups get one field each
+PATH_FIELD_BURGER = "burger"
+PATH_FIELD_PLAYER = "player"
+PATH_FIELD_TYPES = [ObjType.Target, ObjType.Player, ObjType.Shotgun, ObjType.Speed, ObjType.Health]
+# Kinds only so many are kept of, the oldest is removed when there are too many and reused for new objects
+POOLED_TYPES = [ObjType.Bullet, ObjType.EnemyDead]
+
+
+def get_room_for_cell(cell: Tuple[int, int]) -> Tuple[int, int]:
+    return cell[0] // constants.ROOM_SIZE_X, cell[1] // constants.ROOM_SIZE_Y
+
+
+def add_in_uid_order(objs: Dict[Obj, None], obj: Obj) -> None:
+    """ Adds to an ordered set of objects kept in uid order, the same order as the object list"""
+    # New objects have the highest uid, only restored or retyped ones have to be slotted in
+    in_order = len(objs) == 0 or next(reversed(objs)).uid < obj.uid
+    objs[obj] = None
+    if not in_order:
+        ordered = sorted(objs, key=lambda o: o.uid)
+        objs.clear()
+        objs.update(dict.fromkeys(ordered))
+
+
+def get_path_field_key(obj: Obj) -> str:
+    if obj.obj_type == ObjType.Target:
+        return PATH_FIELD_BURGER
+    if obj.obj_type == ObjType.Player:
+        return PATH_FIELD_PLAYER
+    return f"pickup_{obj.uid}"
+
+
 class Game:
     def __init__(self):
         #self.game_state: GameState = GameState.Game
         self.game_state: GameState = GameState.Tutorial
-        self.objects: List[Obj] = []  # List of only objects in current and surrounding rooms
-        self.path = []
-        for i in range(constants.ROOM_SIZE_X):
-            self.path.append([None]*constants.ROOM_SIZE_Y)
+        # Containers of objects are dicts used as ordered sets, so objects leave them without shifting the rest
+        self.objects: Dict[Obj, None] = {}  # Objects in uid order
+        self.occupancy: Dict[Tuple[int, int], Dict[Obj, None]] = {}  # Cell -> objects in that cell, kept in sync with objects
+        self.draw_buckets: Dict[Tuple[int, int], List[Dict[Obj, None]]] = {}  # Room -> its objects by draw priority, each in object list order
+        self.by_type: Dict[ObjType, Dict[Obj, None]] = {}  # Type -> its objects in object list order, used as an ordered set
+        self.colliders: ColliderColumns = ColliderColumns()  # Boxes of the objects that collide, as arrays
+        self.tiles: TileGrid = TileGrid(constants.MAP_SIZE_X, constants.MAP_SIZE_Y)  # Walls and floors, not in the object list
+        self.next_uid = 0
+        self.path_fields: FlowFieldCache = FlowFieldCache(constants.MAP_SIZE_X, constants.MAP_SIZE_Y)  # Distances to the burger, player and pickups
+        self.change_log: Optional[ChangeLog] = None  # Set while the undo journal follows this game
 
         self.player_obj: Obj = None  # Reference to the player
 
@@ -79,6 +123,136 @@ class Game:
 
         self.time_since_game_over = 0
 
+    def add_object(self, obj: Obj) -> None:
+        obj.uid = self.next_uid
+        obj.world = self
+        self.next_uid += 1
+        self.objects[obj] = None
+        self._enter_world(obj)
+        if self.change_log is not None:
+            self.change_log.note_added(obj)
+
+    def restore_object(self, obj: Obj) -> None:
+        """ Puts back a removed object with its old uid, at its old place in the object list"""
+        obj.world = self
+        add_in_uid_order(self.objects, obj)
+        self._enter_world(obj)
+
+    def _enter_world(self, obj: Obj) -> None:
+        self._enter_cell(obj, obj.get_cell())
+        self._add_to_type(obj)
+        self.colliders.update(obj)
+        if obj_blocks_path(obj):
+            self._refresh_path_cell(obj.get_cell())
+        if obj.obj_type in PATH_FIELD_TYPES:
+            self.path_fields.set_target(get_path_field_key(obj), obj.get_cell())
+
+    def remove_object(self, obj: Obj) -> None:
+        del self.objects[obj]
+        self._leave_cell(obj, obj.get_cell())
+        self._remove_from_type(obj, obj.obj_type)
+        self.colliders.remove(obj)
+        if obj_blocks_path(obj):
+            self._refresh_path_cell(obj.get_cell())
+        if obj.obj_type in PATH_FIELD_TYPES:
+            self.path_fields.remove_target(get_path_field_key(obj))
+        if self.change_log is not None:
+            self.change_log.note_removed(obj)
+        obj.world = None
+
+    def on_obj_cell_changed(self, obj: Obj, old_cell: Tuple[int, int]) -> None:
+        self._leave_cell(obj, old_cell)
+        self._enter_cell(obj, obj.get_cell())
+        if obj_blocks_path(obj):
+            self._refresh_path_cell(old_cell)
+            self._refresh_path_cell(obj.get_cell())
+        if obj.obj_type in PATH_FIELD_TYPES:
+            self.path_fields.set_target(get_path_field_key(obj), obj.get_cell())
+
+    def on_obj_priority_changed(self, obj: Obj, old_priority: int) -> None:
+        room = get_room_for_cell(obj.get_cell())
+        del self.draw_buckets[room][old_priority][obj]
+        self._add_to_draw_bucket(obj, room)
+
+    def on_obj_type_changed(self, obj: Obj, old_type: ObjType) -> None:
+        self._remove_from_type(obj, old_type)
+        self._add_to_type(obj)
+        self.colliders.update(obj)
+
+    def on_obj_bbox_changed(self, obj: Obj) -> None:
+        """ Object moved or started or stopped colliding"""
+        self.colliders.update(obj)
+
+    def _add_to_type(self, obj: Obj) -> None:
+        add_in_uid_order(self.by_type.setdefault(obj.obj_type, {}), obj)
+
+    def _remove_from_type(self, obj: Obj, obj_type: ObjType) -> None:
+        del self.by_type[obj_type][obj]
+
+    def _enter_cell(self, obj: Obj, cell: Tuple[int, int]) -> None:
+        self.occupancy.setdefault(cell, {})[obj] = None
+        self._add_to_draw_bucket(obj, get_room_for_cell(cell))
+
+    def _leave_cell(self, obj: Obj, cell: Tuple[int, int]) -> None:
+        cell_objs = self.occupancy[cell]
+        del cell_objs[obj]
+        if len(cell_objs) == 0:
+            del self.occupancy[cell]
+        del self.draw_buckets[get_room_for_cell(cell)][obj.draw_priority][obj]
+
+    def _add_to_draw_bucket(self, obj: Obj, room: Tuple[int, int]) -> None:
+        buckets = self.draw_buckets.setdefault(room, [])
+        while len(buckets) <= obj.draw_priority:
+            buckets.append({})
+        add_in_uid_order(buckets[obj.draw_priority], obj)
+
+    def rebuild_cell_index(self) -> None:
+        """ Occupancy, draw buckets, type registries and colliders from scratch, for when the object list was filled in directly"""
+        self.occupancy = {}
+        self.draw_buckets = {}
+        self.by_type = {}
+        self.colliders = ColliderColumns()
+        for obj in self.objects:
+            self._enter_cell(obj, obj.get_cell())
+            self._add_to_type(obj)
+            self.colliders.update(obj)
+
+    def _refresh_path_cell(self, cell: Tuple[int, int]) -> None:
+        # Map is set once the level is loaded, from then on it's patched cell by cell
+        if not self.path_fields.ready:
+            return
+        walkable = not self.tiles.is_solid(*cell) and not any(obj_blocks_path(obj) for obj in self.occupancy.get(cell, []))
+        self.path_fields.set_walkable(cell, walkable)
+
+    def get_path(self, key: str = PATH_FIELD_BURGER) -> FlowField:
+        return self.path_fields.get_field(key)
+
+    def get_path_dist(self, key: str, cell: Tuple[int, int]) -> int:
+        return self.path_fields.get_dist(key, cell)
+
+    def get_objs_of_type(self, *obj_types: ObjType) -> List[Obj]:
+        """ Objects of the given types, in object list order"""
+        if len(obj_types) == 1:
+            return list(self.by_type.get(obj_types[0], ()))
+        return sorted((obj for obj_type in obj_types for obj in self.by_type.get(obj_type, ())), key=lambda obj: obj.uid)
+
+    def get_oldest(self, obj_type: ObjType) -> Optional[Obj]:
+        """ Earliest added object of the type"""
+        return next(iter(self.by_type.get(obj_type, ())), None)
+
+    def get_objs_in_cell(self, x, y) -> Iterable[Obj]:
+        return self.occupancy.get((x, y), ())
+
+    def get_objs_in_draw_order(self, rooms: List[Tuple[int, int]]) -> Iterator[Obj]:
+        """ Objects in the rooms by draw priority, objects of the same priority in object list order"""
+        room_buckets = [self.draw_buckets[room] for room in rooms if room in self.draw_buckets]
+        for priority in range(max((len(buckets) for buckets in room_buckets), default=0)):
+            lists = [buckets[priority] for buckets in room_buckets if priority < len(buckets) and buckets[priority]]
+            if len(lists) == 1:
+                yield from lists[0]
+            elif lists:
+                yield from heapq.merge(*lists, key=lambda obj: obj.uid)
+
     def get_dice_image(self, i):
         assert len(self.dice) > i
         d = self.dice[i]
@@ -123,25 +297,21 @@ class Game:
         if self.action != Action.Roll:
             return
 
+        bounds = constants.DICE_ROLL_BOUNDS
         if ignore_stuck:
-            rnd = pyxel.rndi(1,9)
+            rnd = rng.rndi(rng.STREAM_DICE, 1, bounds[3])
             if ignore_enemy:
-                rnd = pyxel.rndi(1,8)
+                rnd = rng.rndi(rng.STREAM_DICE, 1, bounds[2])
         else:
-            rnd = pyxel.rndi(1, 10)
-        if rnd <= 2:
-            self.dice[i] = Dice.Move
-        elif rnd <= 6:
-            self.dice[i] = Dice.Shoot
-        elif rnd <= 8:
-            self.dice[i] = Dice.Reload
-        elif rnd <= 9:
-            self.dice[i] = Dice.Enemy
-            self.action_queue.insert(0, Action.MoveEnemy)
-        elif rnd <= 10:
-            self.dice[i] = Dice.Stuck
+            rnd = rng.rndi(rng.STREAM_DICE, 1, bounds[4])
+        for die, bound in zip(DICE_ROLL_FACES, bounds):
+            if rnd <= bound:
+                self.dice[i] = die
+                break
         else:
             assert False
+        if self.dice[i] == Dice.Enemy:
+            self.action_queue.insert(0, Action.MoveEnemy)
         self.dice_roll_timer[i] = 1.5
         resources.play_sound(resources.SOUND_ROLL)
 
@@ -1,13 +1,27 @@
-from typing import List, Tuple, TypedDict, Optional
+from typing import Any, Dict, List, Tuple, TypedDict, Optional
 from enum import Enum
 
+import numpy as np
 import pyxel
 
+import animation
 import resources
+import rng
 from constants import *
 import utils
 
 
+class _Missing:
+    """ Value of an attribute that isn't set. Pickles and copies to the same object, change logs end up in keyframes"""
+    def __reduce__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+# Attributes only some object types set
+TYPE_STATS = ["start_health", "health", "max_ammo", "ammo", "max_movement", "movement", "max_shots", "shots"]
+
+
 class ObjType(Enum):
     Undefined = 0
     Text = 1
@@ -26,12 +40,23 @@ class ObjType(Enum):
 
 
 class Obj:
+    # Walls and floors live in the tile grid, these are the few dozen entities on top. Slots keep them small and quick
+    # to copy for snapshots and undo. Stats only some types have stay unset on the rest
+    __slots__ = ("world", "uid", "_pos_x", "_pos_y", "_cell", "name", "_obj_type", "sprite", "_collides",
+                 "last_input_frame", "text", "velocity", "destroy", "has_shotgun", "last_move_dir",
+                 "move_start_pos", "target_pos", "move_timer", "hit_frames", "bounding_box", "_draw_priority",
+                 "anim_speed", "start_health", "health", "max_ammo", "ammo", "max_movement", "movement",
+                 "max_shots", "shots")
+
     def __init__(self, obj_type: ObjType, sprite: Tuple[int, int], pos: Tuple[int, int], name: str = "Unknown", collides: bool = True, bounding_box: Tuple[int, int, int, int] = None, text: str = None):
+        self.world = None  # Game this object is registered with, notified when the object changes cell
+        self.uid = -1  # Assigned by the world, follows the order of the world's object list
+        self._pos_x = pos[0]
+        self._pos_y = pos[1]
+        self._cell = self._calc_cell()
         self.name = name
         self.obj_type = obj_type
         self.sprite = sprite
-        self.pos_x = pos[0]
-        self.pos_y = pos[1]
         self.collides = collides
         self.last_input_frame = 0  # for anim
         self.text = text
@@ -50,7 +75,7 @@ class Obj:
             self.bounding_box = (0, 0, GRID_CELL_SIZE, GRID_CELL_SIZE)
         else:
             self.bounding_box = bounding_box
-        self.draw_priority = 0  # The higher, the later it will be drawn (on top of others)
+        self.draw_priority = 0
         self.anim_speed = 18
 
         # Player specific
@@ -77,7 +102,7 @@ class Obj:
         if obj_type == ObjType.EnemyBig:
             self.bounding_box = (1, 1, GRID_CELL_SIZE - 1, GRID_CELL_SIZE - 1)
             self.draw_priority = 3
-            self.start_health = pyxel.rndi(2, 3)
+            self.start_health = rng.rndi(rng.STREAM_ENEMY, 2, 3)
             self.health = self.start_health
             self.sprite = resources.SPRITE_ENEMY_BIG_IDLE
             self.anim_speed = 8
@@ -104,6 +129,92 @@ class Obj:
         pos = int(self.pos_x / GRID_CELL_SIZE), int(self.pos_y / GRID_CELL_SIZE)
         return f"[OBJ] {self.name} ({pos[0]}, {pos[1]})"
 
+    @property
+    def pos_x(self):
+        return self._pos_x
+
+    @pos_x.setter
+    def pos_x(self, val):
+        self._pos_x = val
+        self._on_moved()
+
+    @property
+    def obj_type(self):
+        return self._obj_type
+
+    @obj_type.setter
+    def obj_type(self, val):
+        old_val = getattr(self, "_obj_type", None)
+        self._obj_type = val
+        if self.world is not None and old_val != val:
+            self.world.on_obj_type_changed(self, old_val)
+
+    @property
+    def collides(self):
+        return self._collides
+
+    @collides.setter
+    def collides(self, val):
+        old_val = getattr(self, "_collides", None)
+        self._collides = val
+        if self.world is not None and old_val != val:
+            self.world.on_obj_bbox_changed(self)
+
+    @property
+    def draw_priority(self):
+        """ The higher, the later it will be drawn (on top of others)"""
+        return self._draw_priority
+
+    @draw_priority.setter
+    def draw_priority(self, val):
+        old_val = getattr(self, "_draw_priority", None)
+        self._draw_priority = val
+        if self.world is not None and old_val != val:
+            self.world.on_obj_priority_changed(self, old_val)
+
+    @property
+    def pos_y(self):
+        return self._pos_y
+
+    @pos_y.setter
+    def pos_y(self, val):
+        self._pos_y = val
+        self._on_moved()
+
+    def _calc_cell(self) -> Tuple[int, int]:
+        return int(self._pos_x/GRID_CELL_SIZE), int(self._pos_y/GRID_CELL_SIZE)
+
+    def _on_moved(self) -> None:
+        cell = self._calc_cell()
+        if cell != self._cell:
+            old_cell = self._cell
+            self._cell = cell
+            if self.world is not None:
+                self.world.on_obj_cell_changed(self, old_cell)
+        if self.world is not None:
+            self.world.on_obj_bbox_changed(self)
+
+    def __setattr__(self, key: str, val: Any) -> None:
+        # Neither is there yet while an object or a pickled game is being put together
+        log = getattr(getattr(self, "world", None), "change_log", None)
+        if log is not None:
+            log.note(self, key)
+        object.__setattr__(self, key, val)
+
+    def get_state(self) -> Dict[str, Any]:
+        """ Attributes that are set, except the world"""
+        state = {}
+        for key in Obj.__slots__[1:]:
+            val = getattr(self, key, MISSING)
+            if val is not MISSING:
+                state[key] = val
+        return state
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        """ Sets attributes directly, without notifying the world"""
+        for key, val in state.items():
+            setattr(self, key, val)
+
     def get_pos(self) -> Tuple[int, int]:
         return self.pos_x, self.pos_y
 
@@ -111,8 +222,7 @@ class Obj:
         return self.pos_x + HALF_GRID_CELL, self.pos_y + HALF_GRID_CELL
 
     def get_cell(self) -> Tuple[int, int]:
-        mid_pos = self.get_pos()
-        return int(mid_pos[0]/GRID_CELL_SIZE), int(mid_pos[1]/GRID_CELL_SIZE)
+        return self._cell
 
     def get_bbox_world_space(self) -> Tuple[int, int, int, int]:
         return self.pos_x + self.bounding_box[0], self.pos_y + self.bounding_box[1], self.pos_x + self.bounding_box[2], self.pos_y + self.bounding_box[3]
@@ -120,12 +230,82 @@ class Obj:
     def get_render_sprite(self) -> Tuple[int, int]:
         render_sprite = self.sprite
         if type(render_sprite) is list:
-            n = pyxel.noise(self.pos_x/10, self.pos_y/10)
-            render_sprite = render_sprite[int((pyxel.frame_count - self.last_input_frame + 10*n) / self.anim_speed) % len(render_sprite)]
+            render_sprite = animation.get_frame(render_sprite, self.anim_speed, pyxel.frame_count - self.last_input_frame, self._cell)
         return render_sprite
 
 
 
+class ChangeLog:
+    """
+    What the objects of one game were like before they were first changed since the log was last cleared, noted as
+    the changes happen. The undo journal turns it into the delta of a turn.
+    """
+    LOGGED_KEYS = frozenset(Obj.__slots__[1:])  # Properties store through these, so they are covered as well
+
+    def __init__(self):
+        self.old: Dict[int, Dict[str, Any]] = {}  # uid -> attributes changed, values before the first change
+        self.objs: Dict[int, Obj] = {}  # uid -> object, of the ones in old
+        self.added: Dict[int, Obj] = {}
+        self.removed: Dict[int, Dict[str, Any]] = {}  # uid -> full state before the first change
+
+    def clear(self) -> None:
+        self.old.clear()
+        self.objs.clear()
+        self.added.clear()
+        self.removed.clear()
+
+    def note(self, obj: Obj, key: str) -> None:
+        if key not in self.LOGGED_KEYS or obj.uid in self.added:
+            return
+        old = self.old.get(obj.uid)
+        if old is None:
+            old = self.old[obj.uid] = {}
+            self.objs[obj.uid] = obj
+        if key not in old:
+            old[key] = getattr(obj, key, MISSING)
+
+    def note_added(self, obj: Obj) -> None:
+        self.added[obj.uid] = obj
+
+    def note_removed(self, obj: Obj) -> None:
+        if self.added.pop(obj.uid, None) is not None:
+            return
+        state = obj.get_state()
+        self.objs.pop(obj.uid, None)
+        for key, val in self.old.pop(obj.uid, {}).items():
+            if val is MISSING:
+                state.pop(key, None)
+            else:
+                state[key] = val
+        self.removed[obj.uid] = state
+
+
+class ObjPool:
+    """
+    Removed objects kept to build new ones in, so sustained fire doesn't keep allocating.
+    Only objects nothing refers to anymore should be released to it.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.free: List[Obj] = []
+
+    def acquire(self, pos: Tuple[int, int], **params) -> Obj:
+        if not self.free:
+            return Obj(pos=pos, **params)
+        obj = self.free.pop()
+        obj.__init__(pos=pos, **params)
+        return obj
+
+    def release(self, obj: Obj) -> None:
+        if len(self.free) >= self.capacity:
+            return
+        # Constructor sets everything else again
+        for key in TYPE_STATS:
+            if hasattr(obj, key):
+                delattr(obj, key)
+        self.free.append(obj)
+
+
 def collision_bb(pos_a: Tuple[int, int], bb_a: Tuple[int, int, int, int], pos_b: Tuple[int, int], bb_b: Tuple[int, int, int, int]) -> bool:
     collides = pos_a[0] + bb_a[0] < pos_b[0] + bb_b[2] and \
                pos_a[0] + bb_a[2] > pos_b[0] + bb_b[0] and \
@@ -143,6 +323,12 @@ def objs_can_collide(obj_a: Obj, obj_b: Obj) -> bool:
 
     return True
 
+# Objects moving around every turn don't block the burger distance field
+PATH_IGNORED_TYPES = [ObjType.Player, ObjType.Enemy, ObjType.EnemyBig, ObjType.Bullet]
+
+def obj_blocks_path(obj: Obj) -> bool:
+    return obj.collides and obj.obj_type not in PATH_IGNORED_TYPES
+
 def collision_obj(obj_a: Obj, obj_b: Obj) -> bool:
     if not objs_can_collide(obj_a, obj_b):
         return False
@@ -185,6 +371,96 @@ def get_line_bb_intersection_point(line_start: Tuple[float, float],line_end: Tup
 
     return None
 
+class ColliderColumns:
+    """
+    World space boxes, uids and types of the objects that collide, a row each in arrays so the bullet sweep tests
+    all of them in one go. The world keeps the rows in sync, removed rows are filled with the last one.
+    """
+    def __init__(self, capacity: int = 64):
+        self.bbs = np.zeros((capacity, 4))
+        self.uids = np.zeros(capacity, dtype=np.int64)
+        self.types = np.zeros(capacity, dtype=np.uint8)
+        self.objs: List[Obj] = []  # Object of each row
+        self.rows: Dict[Obj, int] = {}
+
+    def __len__(self):
+        return len(self.objs)
+
+    def update(self, obj: Obj) -> None:
+        """ Adds or refreshes the row of the object, or drops it when the object doesn't collide"""
+        if not obj.collides:
+            self.remove(obj)
+            return
+        row = self.rows.get(obj)
+        if row is None:
+            row = len(self.objs)
+            if row == len(self.uids):
+                self.bbs = np.concatenate((self.bbs, np.zeros_like(self.bbs)))
+                self.uids = np.concatenate((self.uids, np.zeros_like(self.uids)))
+                self.types = np.concatenate((self.types, np.zeros_like(self.types)))
+            self.objs.append(obj)
+            self.rows[obj] = row
+        self.bbs[row] = obj.get_bbox_world_space()
+        self.uids[row] = obj.uid
+        self.types[row] = obj.obj_type.value
+
+    def remove(self, obj: Obj) -> None:
+        row = self.rows.pop(obj, None)
+        if row is None:
+            return
+        last = self.objs.pop()
+        if last is not obj:
+            self.objs[row] = last
+            self.rows[last] = row
+            self.bbs[row] = self.bbs[len(self.objs)]
+            self.uids[row] = self.uids[len(self.objs)]
+            self.types[row] = self.types[len(self.objs)]
+
+    def get_rows_in_bbox(self, bbox: Tuple[float, float, float, float], ignored_types: List[ObjType]) -> np.ndarray:
+        """ Rows whose box overlaps or touches the world space bbox, in uid order like the object list"""
+        count = len(self.objs)
+        bbs = self.bbs[:count]
+        found = (bbs[:, 0] <= bbox[2]) & (bbs[:, 2] >= bbox[0]) & (bbs[:, 1] <= bbox[3]) & (bbs[:, 3] >= bbox[1])
+        found &= ~np.isin(self.types[:count], [obj_type.value for obj_type in ignored_types])
+        rows = np.flatnonzero(found)
+        return rows[np.argsort(self.uids[rows], kind="stable")]
+
+
+def get_moving_bb_hit(bb: Tuple[float, float, float, float], move_dir: Tuple[float, float], bbs: np.ndarray) -> Tuple[int, float]:
+    """
+    Sweeps the world space bb along move_dir against an (N, 4) array of world space bbs in one go.
+    Returns index of the earliest hit bb and the fraction of move_dir travelled before touching it, or (-1, 1.0).
+    Overlap is strict like in collision_bb, boxes only touching don't count.
+    """
+    if len(bbs) == 0:
+        return -1, 1.0
+    # Grow the targets by the moving box so its min corner can be traced as a point
+    size_x, size_y = bb[2] - bb[0], bb[3] - bb[1]
+    lo = np.stack((bbs[:, 0] - size_x, bbs[:, 1] - size_y), axis=1)
+    hi = bbs[:, 2:4]
+    start = np.array((bb[0], bb[1]), dtype=float)
+    move = np.array(move_dir, dtype=float)
+
+    t_enter = np.full(len(bbs), -np.inf)
+    t_exit = np.full(len(bbs), np.inf)
+    for axis in range(2):
+        if move[axis] == 0:
+            # Not moving along this axis, has to already be inside the slab
+            inside = (lo[:, axis] < start[axis]) & (start[axis] < hi[:, axis])
+            t_exit[~inside] = -np.inf
+        else:
+            t_a = (lo[:, axis] - start[axis]) / move[axis]
+            t_b = (hi[:, axis] - start[axis]) / move[axis]
+            t_enter = np.maximum(t_enter, np.minimum(t_a, t_b))
+            t_exit = np.minimum(t_exit, np.maximum(t_a, t_b))
+
+    hit = (t_enter < t_exit) & (t_exit > 0) & (t_enter <= 1)
+    if not hit.any():
+        return -1, 1.0
+    t_hit = np.where(hit, np.maximum(t_enter, 0), np.inf)
+    idx = int(np.argmin(t_hit))
+    return idx, float(t_hit[idx])
+
 def get_dist_obj(obj_a: Obj, obj_b: Obj) -> float:
     # TODO: Use bbox center?
     return utils.get_vector_len((obj_b.pos_x - obj_a.pos_x, obj_b.pos_y - obj_a.pos_y))
@@ -237,3 +513,11 @@ ALL_OBJECTS = {
 
     "BULLET": {'name': 'Bullet', "sprite": resources.SPRITE_BULLET, "obj_type": ObjType.Bullet},
 }
+
+# Tilemap sprite -> keys of ALL_OBJECTS drawn with it, in ALL_OBJECTS order
+OBJECTS_BY_SPRITE: Dict[Tuple[int, int], List[str]] = {}
+for _key, _params in ALL_OBJECTS.items():
+    if type(_params["sprite"]) is tuple:
+        OBJECTS_BY_SPRITE.setdefault(_params["sprite"], []).append(_key)
+
+pool = ObjPool(OBJ_POOL_SIZE)
@@ -0,0 +1,256 @@
+import math
+import random
+import sys
+import types
+import zipfile
+from typing import Callable, List, Set, Tuple
+
+import constants
+
+# python -c "import headless; sim = headless.Simulation(); sim.click(100, 100); sim.step(1000)"
+
+
+class HeadlessImage:
+    """ Pixels aren't loaded, every pixel reads as color 0"""
+    def __init__(self, width: int = 256, height: int = 256):
+        self.width = width
+        self.height = height
+
+    def pget(self, x: int, y: int) -> int:
+        return 0
+
+    def rect(self, *args) -> None:
+        pass
+
+    def rectb(self, *args) -> None:
+        pass
+
+    def text(self, *args) -> None:
+        pass
+
+
+class HeadlessTilemap:
+    def __init__(self, width: int = 256, height: int = 256):
+        self.width = width
+        self.height = height
+        self.image = None
+        self.tiles: List[List[Tuple[int, int]]] = [[(0, 0)] * width for _ in range(height)]
+
+    def pget(self, x: int, y: int) -> Tuple[int, int]:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.tiles[y][x]
+        return 0, 0
+
+    def pset(self, x: int, y: int, tile: Tuple[int, int]) -> None:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.tiles[y][x] = tile
+
+    def cls(self, tile: Tuple[int, int]) -> None:
+        self.tiles = [[tile] * self.width for _ in range(self.height)]
+
+
+class HeadlessPyxel(types.ModuleType):
+    """
+    Stand-in for the pyxel module, so the game can be stepped without a window.
+    Input is set by the caller, drawing and sound do nothing. Game randomness comes from rng, not from here.
+    """
+    def __init__(self, seed: int = 0):
+        super().__init__("pyxel")
+        self.width = constants.SCREEN_WIDTH
+        self.height = constants.SCREEN_HEIGHT
+        self.frame_count = 0
+        self.mouse_x = 0
+        self.mouse_y = 0
+        self.pressed: Set[int] = set()
+        self.prev_pressed: Set[int] = set()
+        self.random = random.Random(seed)
+        self.images = [HeadlessImage() for _ in range(3)]
+        self.tilemaps = [HeadlessTilemap() for _ in range(8)]
+
+        # Key codes only need to be distinct
+        for i, name in enumerate(["MOUSE_BUTTON_LEFT", "MOUSE_BUTTON_RIGHT", "KEY_1", "KEY_2", "KEY_3",
+                                  "KEY_A", "KEY_D", "KEY_S", "KEY_W", "KEY_X", "KEY_Z", "KEY_J", "KEY_K",
+                                  "KEY_LEFT", "KEY_RIGHT", "KEY_UP", "KEY_DOWN",
+                                  "GAMEPAD1_BUTTON_A", "GAMEPAD1_BUTTON_B",
+                                  "GAMEPAD1_BUTTON_DPAD_LEFT", "GAMEPAD1_BUTTON_DPAD_RIGHT",
+                                  "GAMEPAD1_BUTTON_DPAD_UP", "GAMEPAD1_BUTTON_DPAD_DOWN"]):
+            setattr(self, name, i)
+
+        # Drawing, sound and window calls are accepted and ignored
+        for name in ["init", "mouse", "cls", "camera", "pal", "blt", "text", "rect", "rectb", "circ", "circb",
+                     "line", "bltm", "play", "playm"]:
+            setattr(self, name, self._ignore)
+
+    @staticmethod
+    def _ignore(*args, **kwargs) -> None:
+        pass
+
+    def load(self, filename: str, **kwargs) -> None:
+        # Only the level tilemap matters for the game logic, read it straight from the resource archive
+        with zipfile.ZipFile(filename) as archive:
+            data = archive.read("pyxel_resource/tilemap0").decode()
+        tilemap = self.tilemaps[0]
+        for y, line in enumerate(data.splitlines()[:tilemap.height]):
+            for x in range(min(len(line) // 4, tilemap.width)):
+                tile = line[x*4:x*4+4]
+                tilemap.tiles[y][x] = int(tile[0:2], 16), int(tile[2:4], 16)
+
+    def image(self, img: int) -> HeadlessImage:
+        return self.images[img]
+
+    def tilemap(self, tm: int) -> HeadlessTilemap:
+        return self.tilemaps[tm]
+
+    def run(self, update: Callable, draw: Callable) -> None:
+        raise RuntimeError("Headless pyxel has no main loop, step the game with Simulation instead")
+
+    #
+    # Input
+    #
+    def btn(self, key: int) -> bool:
+        return key in self.pressed
+
+    def btnp(self, key: int, *args, **kwargs) -> bool:
+        return key in self.pressed and key not in self.prev_pressed
+
+    def reset(self) -> None:
+        self.frame_count = 0
+        self.mouse_x = 0
+        self.mouse_y = 0
+        self.pressed.clear()
+        self.prev_pressed.clear()
+
+    def next_frame(self) -> None:
+        self.prev_pressed = set(self.pressed)
+        self.frame_count += 1
+
+    #
+    # Math, angles are in degrees like in pyxel
+    #
+    def rseed(self, seed: int) -> None:
+        self.random.seed(seed)
+
+    def rndi(self, a: int, b: int) -> int:
+        return self.random.randint(min(a, b), max(a, b))
+
+    def rndf(self, a: float, b: float) -> float:
+        return self.random.uniform(a, b)
+
+    def noise(self, x: float, y: float = 0, z: float = 0) -> float:
+        return 0.0
+
+    @staticmethod
+    def sgn(x: float) -> int:
+        return 1 if x > 0 else (-1 if x < 0 else 0)
+
+    @staticmethod
+    def atan2(y: float, x: float) -> float:
+        return math.degrees(math.atan2(y, x))
+
+    @staticmethod
+    def sin(deg: float) -> float:
+        return math.sin(math.radians(deg))
+
+    @staticmethod
+    def cos(deg: float) -> float:
+        return math.cos(math.radians(deg))
+
+
+def install() -> HeadlessPyxel:
+    """ Has to run before any game module imports pyxel"""
+    backend = sys.modules.get("pyxel")
+    if isinstance(backend, HeadlessPyxel):
+        return backend
+    assert backend is None, "pyxel was already imported, install the headless backend first"
+    backend = HeadlessPyxel()
+    sys.modules["pyxel"] = backend
+    return backend
+
+
+class Simulation:
+    """
+    Runs the same update step as the windowed game, driven by scripted input.
+    Drawing is skipped unless asked for, all game input is handled in update().
+    """
+    def __init__(self, seed: int = 0, render: bool = False):
+        self.pyxel = install()
+        # Game modules import pyxel, so they can only be loaded once the stand-in is in place
+        import main
+        from controls import Controls
+        import replay
+        import rng
+        self.main = main
+        self.controls = Controls
+        self.replay = replay
+        self.rng = rng
+        self.render = render
+        self.input_log = None  # Set when playing back a recorded run
+        # Simulations share the module state of this process, start from a clean slate
+        self.pyxel.reset()
+        Controls.playback = None
+        main.init(seed)
+
+    @staticmethod
+    def from_input_log(path: str, render: bool = False) -> "Simulation":
+        """ Starts a simulation that plays back a recorded run from its first frame"""
+        install()
+        import replay
+        log = replay.InputLog(path)
+        sim = Simulation(log.seed, render)
+        sim.input_log = log
+        sim.controls.playback = iter(log.frames)
+        return sim
+
+    def start_recording(self, path: str) -> None:
+        """ Call right after creating the simulation, a replay starts from the initial state"""
+        self.controls.recorder = self.replay.InputRecorder(path, self.rng.get_seed(), self.main.get_state)
+
+    def stop_recording(self) -> None:
+        self.controls.recorder.close()
+        self.controls.recorder = None
+
+    @property
+    def game(self):
+        return self.main.game.game
+
+    def seek(self, frame: int) -> None:
+        """ Jumps to a frame of the played back log, simulating only from the nearest keyframe"""
+        keyframe = self.input_log.get_keyframe(frame)
+        if keyframe is None:
+            start_frame = 0
+            self.main.init(self.input_log.seed)
+        else:
+            start_frame, state = keyframe
+            self.main.set_state(state)
+        self.pyxel.frame_count = start_frame
+        self.controls.playback = iter(self.input_log.frames[start_frame:])
+        self.step(frame - start_frame)
+
+    def run_replay(self) -> None:
+        """ Steps through the rest of the played back input as fast as possible, stopping on the last recorded frame"""
+        self.step(len(self.input_log.frames) - self.pyxel.frame_count)
+
+    def step(self, frames: int = 1) -> None:
+        for _ in range(frames):
+            self.main.update()
+            if self.render:
+                self.main.draw()
+            self.pyxel.next_frame()
+
+    def move_mouse(self, x: int, y: int) -> None:
+        self.pyxel.mouse_x = x
+        self.pyxel.mouse_y = y
+
+    def press(self, key: int) -> None:
+        self.pyxel.pressed.add(key)
+
+    def release(self, key: int) -> None:
+        self.pyxel.pressed.discard(key)
+
+    def click(self, x: int, y: int) -> None:
+        """ Presses and releases the left mouse button over two frames"""
+        self.move_mouse(x, y)
+        self.press(self.pyxel.MOUSE_BUTTON_LEFT)
+        self.step()
+        self.release(self.pyxel.MOUSE_BUTTON_LEFT)
+        self.step()
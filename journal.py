@@ -0,0 +1,131 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+import constants
+import game
+import snapshot
+from game_object import MISSING, ChangeLog, Obj
+
+ObjStates = Dict[int, Dict[str, Any]]
+
+
+class TurnDelta:
+    """ What one turn changed, stored as the values to put back to undo it"""
+    def __init__(self, fields: Dict[str, Any], objs: ObjStates, added: List[int], removed: List[Dict[str, Any]]):
+        self.fields = fields  # Game attributes that changed, old values
+        self.objs = objs  # uid -> changed attributes of objects that existed before and after, old values
+        self.added = added  # uids of objects created during the turn
+        self.removed = removed  # Full state of objects removed during the turn
+
+    def is_empty(self) -> bool:
+        return not (self.fields or self.objs or self.added or self.removed)
+
+
+def take_changes(g: game.Game, old_fields: Dict[str, Any]) -> TurnDelta:
+    """ Delta that takes the game back to old_fields and to where its change log started, the log starts over"""
+    log = g.change_log
+    new_fields = snapshot.get_game_fields(g)
+    fields = {key: val for key, val in old_fields.items() if new_fields.get(key) != val}
+    objs = {}
+    for uid, old in log.old.items():
+        obj = log.objs[uid]
+        # Attributes that weren't set before stay set, the same as a full copy of the old state would have them
+        changed = {key: val for key, val in old.items() if val is not MISSING and getattr(obj, key, MISSING) != val}
+        if changed:
+            objs[uid] = changed
+    delta = TurnDelta(fields, objs, list(log.added), list(log.removed.values()))
+    log.clear()
+    return delta
+
+
+def apply(g: game.Game, delta: TurnDelta) -> None:
+    """ Patches the delta into the live game, going through the game so occupancy and distance fields follow"""
+    by_uid = {obj.uid: obj for obj in g.objects}
+    for uid in delta.added:
+        g.remove_object(by_uid.pop(uid))
+    for state in delta.removed:
+        obj = Obj.__new__(Obj)
+        obj.set_state(state)
+        g.restore_object(obj)
+        by_uid[obj.uid] = obj
+    for uid, changed in delta.objs.items():
+        obj = by_uid[uid]
+        changed = dict(changed)
+        pos_x = changed.pop("_pos_x", obj.pos_x)
+        pos_y = changed.pop("_pos_y", obj.pos_y)
+        changed.pop("_cell", None)
+        draw_priority = changed.pop("_draw_priority", obj.draw_priority)
+        obj_type = changed.pop("_obj_type", obj.obj_type)
+        obj.set_state(changed)
+        # Setters move the object between cells, draw buckets and type registries
+        obj.pos_x = pos_x
+        obj.pos_y = pos_y
+        obj.draw_priority = draw_priority
+        obj.obj_type = obj_type
+        # Collides and the bounding box may have been set directly above
+        g.on_obj_bbox_changed(obj)
+    for key, val in delta.fields.items():
+        if key in snapshot.OBJ_REF_FIELDS:
+            val = by_uid[val] if val is not None else None
+        elif type(val) is list:
+            val = list(val)
+        setattr(g, key, val)
+
+
+class TurnJournal:
+    """
+    Bounded undo history. record() is called right before an action changes the game and stores only what changed
+    since the previous call, undo() walks back through those deltas. Objects note their own changes in the game's
+    ChangeLog as they happen, so only changed objects are looked at. Random streams aren't rewound.
+    """
+    def __init__(self, max_turns: int = constants.UNDO_HISTORY):
+        self.game: game.Game = None
+        self.turns: Deque[TurnDelta] = deque(maxlen=max_turns)
+        # Game fields at the last record(), the start of the current turn
+        self.base_fields: Dict[str, Any] = {}
+        # Nothing was recorded since the last undo, whatever changed since is only the clock running
+        self.at_turn_start = False
+
+    def reset(self, g: game.Game) -> None:
+        self.game = g
+        self.turns.clear()
+        g.change_log = ChangeLog()
+        self.base_fields = snapshot.get_game_fields(g)
+        self.at_turn_start = False
+
+    def record(self, g: game.Game) -> None:
+        if g is not self.game or g.change_log is None:
+            # Game was replaced (checkpoint, loaded state), history of the old one doesn't apply
+            self.reset(g)
+            return
+        self.turns.append(take_changes(g, self.base_fields))
+        self.base_fields = snapshot.get_game_fields(g)
+        self.at_turn_start = False
+
+    def can_undo(self, g: game.Game) -> bool:
+        return g is self.game and g.change_log is not None
+
+    def undo(self, g: game.Game, turns: int = 1) -> int:
+        """
+        Goes back to the start of the current turn and turns-1 more before it, returns how many were undone.
+        The current turn only counts when something happened in it, otherwise the turns before it are undone.
+        """
+        if not self.can_undo(g) or turns <= 0:
+            return 0
+        current = take_changes(g, self.base_fields)
+        apply(g, current)
+        undone = 0 if current.is_empty() or self.at_turn_start else 1
+        while undone < turns and self.turns:
+            apply(g, self.turns.pop())
+            undone += 1
+        # Putting things back went through the objects too, that's not a change of the next turn
+        g.change_log.clear()
+        self.base_fields = snapshot.get_game_fields(g)
+        self.at_turn_start = True
+        return undone
+
+    def get_size(self) -> Tuple[int, int]:
+        """ Turns stored and the number of values they hold"""
+        values = sum(len(t.fields) + sum(len(c) for c in t.objs.values()) + len(t.added) +
+                     sum(len(s) for s in t.removed) for t in self.turns)
+        return len(self.turns), values
@@ -0,0 +1,113 @@
+import contextlib
+import hashlib
+import os
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyxel
+
+import constants
+import game
+import room
+import tile_grid
+from game_object import ALL_OBJECTS, OBJECTS_BY_SPRITE, Obj, ObjType
+
+# Bump when the cache contents change
+LEVEL_CACHE_VERSION = 1
+OBJECT_KEYS = list(ALL_OBJECTS.keys())
+CACHE_ARRAYS = {"keys", "positions", "walkable", "burger_target", "burger_dist"}
+
+
+def compile_level() -> List[Tuple[str, Tuple[int, int]]]:
+    """ Objects of the level tilemap as (ALL_OBJECTS key, position), in the order they're added to the game"""
+    # Note tilemaps are of size 8x8, our game works on 16x16 so we need to do some work to get correct references
+    tilemap = pyxel.tilemap(0)
+    entries = []
+    for x in range(0, constants.MAP_SIZE_X):
+        for y in range(0, constants.MAP_SIZE_Y):
+            tile = tilemap.pget(x*2, y*2)
+            tile = int(tile[0]/2), int(tile[1]/2)
+            for obj_key in OBJECTS_BY_SPRITE.get(tile, []):
+                entries.append((obj_key, room.get_pos_for_room(cell_pos=(x, y))))
+    return entries
+
+
+def get_cache_path(resource_file: str) -> str:
+    digest = hashlib.sha1()
+    with open(resource_file, "rb") as f:
+        digest.update(f.read())
+    # Compiled level also depends on the object specs and the map size
+    specs = [(key, params["sprite"], params["obj_type"].name) for key, params in ALL_OBJECTS.items()]
+    digest.update(repr((LEVEL_CACHE_VERSION, constants.MAP_SIZE_X, constants.MAP_SIZE_Y, specs)).encode())
+    # Relative cache dirs are next to the game, not wherever it was started from
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), constants.LEVEL_CACHE_DIR)
+    return os.path.join(cache_dir, f"level_{digest.hexdigest()[:16]}.npz")
+
+
+def read_cache(cache_path: str) -> Optional[Dict[str, np.ndarray]]:
+    """ The cached level arrays, None when there's no cache or it can't be read and the level has to be compiled"""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as data:
+            if not CACHE_ARRAYS.issubset(data.files):
+                return None
+            return {key: data[key] for key in CACHE_ARRAYS}
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+        # Cut short or damaged, it's written again once the level is compiled
+        return None
+
+
+def write_cache(cache_path: str, entries: List[Tuple[str, Tuple[int, int]]]) -> None:
+    path_fields = game.game.path_fields
+    burger_field = game.game.get_path(game.PATH_FIELD_BURGER)
+    # Written aside and moved in place, parallel runs may be starting at the same time
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, "wb") as f:
+            np.savez(f,
+                     keys=np.array([OBJECT_KEYS.index(key) for key, _ in entries], dtype=np.uint8),
+                     positions=np.array([pos for _, pos in entries], dtype=np.int32).reshape((-1, 2)),
+                     walkable=path_fields.walkable,
+                     burger_target=np.array(path_fields.targets[game.PATH_FIELD_BURGER], dtype=np.int32),
+                     burger_dist=burger_field.dist)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # Read only install or a full disk, the level was just compiled so the game goes on without the cache
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+
+
+def load_level(resource_file: str) -> None:
+    """
+    Adds the level tiles and objects to the game and sets up its path fields.
+    With LEVEL_CACHE_DIR set, a level compiled from the same resources is read from there instead of the tilemap.
+    """
+    cache_path = get_cache_path(resource_file) if constants.LEVEL_CACHE_DIR else None
+    cached = read_cache(cache_path) if cache_path else None
+    if cached is not None:
+        entries = [(OBJECT_KEYS[i], (x, y)) for i, (x, y) in zip(cached["keys"].tolist(), cached["positions"].tolist())]
+    else:
+        entries = compile_level()
+
+    obj_target = None
+    for obj_key, pos in entries:
+        params = ALL_OBJECTS[obj_key]
+        if params["obj_type"] in tile_grid.TILE_TYPES:
+            game.game.tiles.add_tile(obj_key, (pos[0] // constants.GRID_CELL_SIZE, pos[1] // constants.GRID_CELL_SIZE))
+            continue
+        obj = Obj(pos=pos, **params)
+        game.game.add_object(obj)
+        if obj.obj_type == ObjType.Target:
+            obj_target = obj
+    assert obj_target is not None
+
+    room.init_path_fields()
+    path_fields = game.game.path_fields
+    if (cached is not None and np.array_equal(cached["walkable"], path_fields.walkable) and
+            tuple(cached["burger_target"].tolist()) == path_fields.targets[game.PATH_FIELD_BURGER]):
+        path_fields.set_field(game.PATH_FIELD_BURGER, cached["burger_dist"])
+    elif cache_path:
+        write_cache(cache_path, entries)
@@ -1,8 +1,11 @@
+import atexit
+import functools
 import math
+import os
 from typing import List, Tuple
 from enum import Enum
-from copy import deepcopy
 
+import numpy as np
 import pyxel
 
 import constants
@@ -11,8 +14,18 @@ import utils
 import interp
 from controls import Controls
 import resources
+import rng
+import replay
 from game_object import Obj, ObjType
+from flow_field import UNREACHABLE
 import room
+import level
+import slide_banner
+import static_layer
+import text_cache
+import snapshot
+import journal
+import savegame
 import game
 
 # pyxel run main.py
@@ -21,59 +34,121 @@ import game
 # pyxel app2html Pyxel.pyxapp
 # pyxel app2exe Pyxel.pyxapp
 
+frame_stopped = False  # Set by update() while hit stop freezes the game
+turn_journal = journal.TurnJournal()  # Undo history of the player's actions
 
-def init():
+
+def init(seed: int = None):
     pyxel.init(constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT, title="LD Game", fps=constants.FPS, display_scale=3)
-    pyxel.load("assets/my_resource.pyxres", image=True, tilemap=True, sound=True, music=True)
+    pyxel.load(constants.RESOURCE_FILE, image=True, tilemap=True, sound=True, music=True)
     pyxel.mouse(False)
+    text_cache.cache.clear()
+    slide_banner.bake()
+
+    if constants.REPLAY_INPUT_FILE:
+        seed, frames = replay.load_input_log(constants.REPLAY_INPUT_FILE)
+        Controls.playback = iter(frames)
+    seed = rng.seed(seed)
+    if constants.RECORD_INPUT_FILE:
+        Controls.recorder = replay.InputRecorder(constants.RECORD_INPUT_FILE, seed, get_state)
+        atexit.register(Controls.recorder.close)
 
     game.init_game()
 
     # Add player
     obj = Obj(pos=(6*constants.GRID_CELL_SIZE, 2*constants.GRID_CELL_SIZE), **game_object.ALL_OBJECTS['PLAYER'])
-    game.game.objects.append(obj)
+    game.game.add_object(obj)
     game.game.player_obj = obj
     obj = Obj(pos=(8*constants.GRID_CELL_SIZE, 5*constants.GRID_CELL_SIZE), **game_object.ALL_OBJECTS['SHOTGUN'])
-    game.game.objects.append(obj)
-    game.game.objects.append(Obj(pos=(8*constants.GRID_CELL_SIZE, 5*constants.GRID_CELL_SIZE), **game_object.ALL_OBJECTS['BG']))
+    game.game.add_object(obj)
+    game.game.tiles.add_tile('BG', (8, 5))
     obj = Obj(pos=(1*constants.GRID_CELL_SIZE, 6*constants.GRID_CELL_SIZE), **game_object.ALL_OBJECTS['HEALTH'])
-    game.game.objects.append(obj)
+    game.game.add_object(obj)
     obj = Obj(pos=(12*constants.GRID_CELL_SIZE, 2*constants.GRID_CELL_SIZE), **game_object.ALL_OBJECTS['SPEED'])
-    game.game.objects.append(obj)
+    game.game.add_object(obj)
 
     # Load level from tilemap
-    # Note tilemaps are of size 8x8, our game works on 16x16 so we need to do some work to get correct references
-    tilemap = pyxel.tilemap(0)
-    obj_target = None
-    for x in range(0, 64):
-        for y in range(0, 64):
-            tile = tilemap.pget(x*2,y*2)
-            tile = int(tile[0]/2), int(tile[1]/2)
-            for obj_key in game_object.ALL_OBJECTS.keys():
-                if game_object.ALL_OBJECTS[obj_key]['sprite'] == tile:
-                    obj = Obj(pos=room.get_pos_for_room(cell_pos=(x, y)), **game_object.ALL_OBJECTS[obj_key])
-                    game.game.objects.append(obj)
-                    if obj.obj_type == ObjType.Target:
-                        obj_target = obj
-
-    assert obj_target is not None
-    room.floodfill(obj_target.get_cell())
+    level.load_level(constants.RESOURCE_FILE)
 
     game.game.start_new_wave(started_with_timer=True)
 
     resources.play_music(resources.MUSIC_A)
 
     global game_checkpoint
-    game_checkpoint = deepcopy(game.game)
+    game_checkpoint = snapshot.take(game.game)
+
+    # Recorded and replayed runs always start from the seed
+    if constants.SAVE_FILE and not constants.RECORD_INPUT_FILE and not constants.REPLAY_INPUT_FILE:
+        if os.path.exists(constants.SAVE_FILE):
+            streams = rng.RandomStreams()
+            try:
+                saved = savegame.load(constants.SAVE_FILE, level=game.game, streams=streams)
+            except (savegame.SaveGameError, OSError) as e:
+                # Saves from older versions or cut short by a crash can't be resumed, start a new game instead
+                print(f"Can't resume: {e}")
+                saved = None
+            if saved is not None and saved.game_state == game.GameState.Game:
+                # Losing goes back to where the game was resumed
+                game.game = saved
+                rng.streams = streams
+                game_checkpoint = snapshot.take(game.game)
+        atexit.register(save_game)
+
+    turn_journal.reset(game.game)
+    static_layer.layer.invalidate()
+
+
+def save_game():
+    if game.game.game_state == game.GameState.Game:
+        savegame.save(game.game, constants.SAVE_FILE)
+    elif os.path.exists(constants.SAVE_FILE):
+        # Lost run, next start is a new game
+        os.remove(constants.SAVE_FILE)
 
 
-def update():
-    global game
+def get_state():
+    """ Everything update() carries over between frames, stored as replay keyframes"""
+    return game.game, game_checkpoint, frame_stopped, rng.streams, turn_journal
+
+
+def set_state(state) -> None:
     global game_checkpoint
+    global frame_stopped
+    global turn_journal
+    game.game, game_checkpoint, frame_stopped, rng.streams, turn_journal = state
+    static_layer.layer.invalidate()
+
 
-    if game.game.stop_frames > 0:
+def update():
+    global frame_stopped
+
+    Controls.begin_frame()
+
+    # Hit stop freezes the whole frame, drawing included
+    frame_stopped = game.game.stop_frames > 0
+    if frame_stopped:
+        game.game.stop_frames -= 1
         return
 
+    update_world()
+
+    # Hit stop started by this frame's world update skips the input handling as well
+    frame_stopped = game.game.stop_frames > 0
+    if frame_stopped:
+        game.game.stop_frames -= 1
+        return
+
+    update_ui()
+
+
+def update_replay():
+    for _ in range(constants.REPLAY_SPEED):
+        update()
+
+
+def update_world():
+    global game_checkpoint
+
     if Controls.right():
         game.game.camera_x += 1
 
@@ -83,14 +158,21 @@ def update():
     if game.game.cam_shake_timer > 0.0:
         game.game.cam_shake_timer -= constants.FRAME_TIME
         str = max(1, int(game.game.cam_shake_timer*10))
-        pyxel.camera(game.game.camera_x+pyxel.rndi(-str, str), game.game.camera_y+pyxel.rndi(-str, str))
+        pyxel.camera(game.game.camera_x+rng.rndi(rng.STREAM_CAMERA, -str, str), game.game.camera_y+rng.rndi(rng.STREAM_CAMERA, -str, str))
     else:
         pyxel.camera(game.game.camera_x, game.game.camera_y)
 
+    # Hit flashes and the slide text run down here, draw() only reads them
+    for obj in game.game.objects:
+        if obj.hit_frames > 0:
+            obj.hit_frames -= 1
+    if game.game.slide_text_timer > -1.5:
+        game.game.slide_text_timer -= constants.FRAME_TIME
+
     if game.game.game_state == game.GameState.GameOver:
         game.game.time_since_game_over += constants.FRAME_TIME
         if game.game.time_since_game_over > 1.5 and Controls.mouse():
-            game.game = deepcopy(game_checkpoint)
+            game.game = snapshot.restore(game_checkpoint)
             return
     else:
         #
@@ -107,7 +189,7 @@ def update():
                     game.game.time_since_tutorial_step = 0
                     if game.game.tutorial_step >= 9:
                         game.game.game_state = game.GameState.Game
-                        game_checkpoint = deepcopy(game.game)
+                        game_checkpoint = snapshot.take(game.game)
 
         if game.game.action == game.Action.Roll and len(game.game.action_queue ) > 0:
             game.game.action = game.game.action_queue.pop()
@@ -129,24 +211,24 @@ def update():
                     dir = (game.game.shoot_target[0] - player.pos_x - constants.HALF_GRID_CELL, game.game.shoot_target[1] - player.pos_y - constants.HALF_GRID_CELL)
                     dir_init = utils.get_vector_normalised(dir)
                     angle = pyxel.atan2(dir_init[1], dir_init[0])
-                    angle += utils.deg_to_rad((pyxel.rndf(0.0, 1.0) - 0.5) * 600)  # TODO: Thats not right?
+                    angle += utils.deg_to_rad((rng.rndf(rng.STREAM_BULLETS, 0.0, 1.0) - 0.5) * 600)  # TODO: Thats not right?
                     dir = dir_init[0] + pyxel.cos(angle), dir_init[1] + pyxel.sin(angle)
-                    obj = Obj(pos=(player.pos_x+dir[0], player.pos_y+dir[1]), **game_object.ALL_OBJECTS['BULLET'])
+                    obj = game_object.pool.acquire((player.pos_x+dir[0], player.pos_y+dir[1]), **game_object.ALL_OBJECTS['BULLET'])
                     obj.velocity = dir*constants.BULLET_SPEED
-                    game.game.objects.append(obj)
+                    game.game.add_object(obj)
                     if player.has_shotgun:
-                        obj = Obj(pos=(player.pos_x + dir[0], player.pos_y + dir[1]), **game_object.ALL_OBJECTS['BULLET'])
+                        obj = game_object.pool.acquire((player.pos_x + dir[0], player.pos_y + dir[1]), **game_object.ALL_OBJECTS['BULLET'])
                         angle = pyxel.atan2(dir_init[1], dir_init[0])
-                        angle += utils.deg_to_rad((pyxel.rndf(0.0, 1.0) - 1.5) * 600)  # TODO: Thats not right?
+                        angle += utils.deg_to_rad((rng.rndf(rng.STREAM_BULLETS, 0.0, 1.0) - 1.5) * 600)  # TODO: Thats not right?
                         dir = dir_init[0] + pyxel.cos(angle), dir_init[1] + pyxel.sin(angle)
                         obj.velocity = dir * constants.BULLET_SPEED
-                        game.game.objects.append(obj)
-                        obj = Obj(pos=(player.pos_x + dir[0], player.pos_y + dir[1]), **game_object.ALL_OBJECTS['BULLET'])
+                        game.game.add_object(obj)
+                        obj = game_object.pool.acquire((player.pos_x + dir[0], player.pos_y + dir[1]), **game_object.ALL_OBJECTS['BULLET'])
                         angle = pyxel.atan2(dir_init[1], dir_init[0])
-                        angle += utils.deg_to_rad((pyxel.rndf(0.0, 1.0) + 0.5) * 600)  # TODO: Thats not right?
+                        angle += utils.deg_to_rad((rng.rndf(rng.STREAM_BULLETS, 0.0, 1.0) + 0.5) * 600)  # TODO: Thats not right?
                         dir = dir_init[0] + pyxel.cos(angle), dir_init[1] + pyxel.sin(angle)
                         obj.velocity = dir * constants.BULLET_SPEED
-                        game.game.objects.append(obj)
+                        game.game.add_object(obj)
 
                     resources.play_sound(resources.SOUND_SHOT)
                     game.game.player_obj.shots -= 1
@@ -163,7 +245,7 @@ def update():
                     game.game.shoot_time -= 2.0
                 val = abs(game.game.shoot_time)
                 game.game.shoot_target = player.get_pos_mid()
-                dir = (pyxel.mouse_x - game.game.shoot_target[0], pyxel.mouse_y - game.game.shoot_target[1])
+                dir = (Controls.mouse_x() - game.game.shoot_target[0], Controls.mouse_y() - game.game.shoot_target[1])
                 dir = utils.get_vector_normalised(dir)
                 angle = pyxel.atan2(dir[1], dir[0])
                 angle += utils.deg_to_rad((val-0.5)*1600)  # TODO: Thats not right?
@@ -171,59 +253,63 @@ def update():
                 game.game.shoot_target = (game.game.shoot_target[0] + pyxel.cos(angle)*1.5*constants.GRID_CELL_SIZE, game.game.shoot_target[1] + pyxel.sin(angle)*1.5*constants.GRID_CELL_SIZE)
 
         destroy_list = []
-        for obj_idx, obj in enumerate(game.game.objects):
+        knocked_back = []
+        # Spawns add to the objects while they're gone through
+        for obj in list(game.game.objects):
             if obj.destroy:
                 destroy_list.append(obj)
 
             if obj.obj_type == ObjType.Bullet:
                 if obj.velocity == (0, 0):
                     continue
-                obj.pos_x += obj.velocity[0]
-                obj.pos_y += obj.velocity[1]
+                # Sweep the bullet over this frame's movement so it can't skip past thin boxes
+                bbox = obj.get_bbox_world_space()
+                swept_bbox = min(bbox[0], bbox[0]+obj.velocity[0]), min(bbox[1], bbox[1]+obj.velocity[1]), max(bbox[2], bbox[2]+obj.velocity[0]), max(bbox[3], bbox[3]+obj.velocity[1])
+                colliders = game.game.colliders
+                rows = colliders.get_rows_in_bbox(swept_bbox, [ObjType.Player, ObjType.Bullet])
+                # Walls come from the tile grid, they go first so hit indices past them are collider rows
+                wall_bbs = game.game.tiles.get_solid_boxes(swept_bbox)
+                candidate_bbs = np.concatenate((wall_bbs, colliders.bbs[rows]))
+                hit_idx, hit_t = game_object.get_moving_bb_hit(bbox, (obj.velocity[0], obj.velocity[1]), candidate_bbs)
+                obj.pos_x += obj.velocity[0]*hit_t
+                obj.pos_y += obj.velocity[1]*hit_t
                 hit_something = False
-                for obj_2 in game.game.objects:
-                    if obj is not obj_2 and obj_2.obj_type is not ObjType.Player and obj_2.obj_type is not ObjType.Bullet and obj_2.collides:
-                        if game_object.collision_obj(obj, obj_2):
-                            vel = obj.velocity
-                            obj.velocity = (0, 0)
-                            obj.draw_priority = 2
-                            obj.sprite = resources.SPRITE_BULLET_SHELL
-                            obj.collides = False
-                            hit_something = True
-                            game.game.count_bullets += 1
-                            if game.game.count_bullets > 10:
-                                for bul in game.game.objects:
-                                    if bul.obj_type == ObjType.Bullet:
-                                        destroy_list.append(bul)
-                                        break
-
-                            if obj_2.obj_type == ObjType.Enemy or obj_2.obj_type == ObjType.EnemyBig:
-                                resources.play_sound(resources.SOUND_HIT)
-                                obj_2.health -= 1
-                                if obj_2.health <= 0:
-                                    if obj_2.obj_type == ObjType.Enemy:
-                                        obj_2.sprite = resources.SPRITE_ENEMY_DEATH
-                                        game.game.stop_frames = 3
-                                        game.game.cam_shake_timer = 0.1
-                                    elif obj_2.obj_type == ObjType.EnemyBig:
-                                        obj_2.sprite = resources.SPRITE_ENEMY_BIG_DEATH
-                                        game.game.stop_frames = 5
-                                        game.game.cam_shake_timer = 0.15
-                                    obj_2.hit_frames = 12
-                                    obj_2.target_pos = (obj_2.pos_x + obj.velocity[0]*2, obj_2.pos_y + obj.velocity[1]*2)
-                                    obj_2.move_start_pos = obj_2.get_pos()
-                                    game.game.enemies_killed += 1
-                                    obj_2.obj_type = ObjType.EnemyDead
-                                    obj_2.collides = False
-                                    resources.play_sound(resources.SOUND_ENEMY_DEATH)
-                                    obj.pos_x += vel[0]*2
-                                    obj.pos_x += vel[1]*2
-                                    game.game.count_enemies_d += 1
-                                    if game.game.count_enemies_d > 10:
-                                        for bul in game.game.objects:
-                                            if bul.obj_type in [ObjType.EnemyDead]:
-                                                destroy_list.append(bul)
-                                                break
+                if hit_idx >= 0:
+                    obj_2 = colliders.objs[rows[hit_idx - len(wall_bbs)]] if hit_idx >= len(wall_bbs) else None
+                    vel = obj.velocity
+                    obj.velocity = (0, 0)
+                    obj.draw_priority = 2
+                    obj.sprite = resources.SPRITE_BULLET_SHELL
+                    obj.collides = False
+                    hit_something = True
+                    game.game.count_bullets += 1
+                    if game.game.count_bullets > 10:
+                        destroy_list.append(game.game.get_oldest(ObjType.Bullet))
+
+                    if obj_2 is not None and obj_2.obj_type in [ObjType.Enemy, ObjType.EnemyBig]:
+                        resources.play_sound(resources.SOUND_HIT)
+                        obj_2.health -= 1
+                        if obj_2.health <= 0:
+                            if obj_2.obj_type == ObjType.Enemy:
+                                obj_2.sprite = resources.SPRITE_ENEMY_DEATH
+                                game.game.stop_frames = 3
+                                game.game.cam_shake_timer = 0.1
+                            elif obj_2.obj_type == ObjType.EnemyBig:
+                                obj_2.sprite = resources.SPRITE_ENEMY_BIG_DEATH
+                                game.game.stop_frames = 5
+                                game.game.cam_shake_timer = 0.15
+                            obj_2.hit_frames = 12
+                            obj_2.target_pos = (obj_2.pos_x + obj.velocity[0]*2, obj_2.pos_y + obj.velocity[1]*2)
+                            obj_2.move_start_pos = obj_2.get_pos()
+                            game.game.enemies_killed += 1
+                            obj_2.obj_type = ObjType.EnemyDead
+                            obj_2.collides = False
+                            resources.play_sound(resources.SOUND_ENEMY_DEATH)
+                            obj.pos_x += vel[0]*2
+                            obj.pos_x += vel[1]*2
+                            game.game.count_enemies_d += 1
+                            if game.game.count_enemies_d > 10:
+                                destroy_list.append(game.game.get_oldest(ObjType.EnemyDead))
                 if hit_something == True:
                     resources.play_sound(resources.SOUND_MISS)
                     game.game.cam_shake_timer = 0.06
@@ -233,19 +319,19 @@ def update():
                         game.game.cam_shake_timer = 0.03
                         spawn_enemy = 'ENEMY'
                         if game.game.current_wave > 1:
-                            if pyxel.rndi(1, 10) < 2:
+                            if rng.rndi(rng.STREAM_SPAWN, 1, 10) < 2:
                                 spawn_enemy = 'ENEMY_BIG'
                                 game.game.cam_shake_timer = 0.1
                         elif game.game.current_wave > 3:
-                            if pyxel.rndi(1, 10) < 3:
+                            if rng.rndi(rng.STREAM_SPAWN, 1, 10) < 3:
                                 spawn_enemy = 'ENEMY_BIG'
                                 game.game.cam_shake_timer = 0.1
                         elif game.game.current_wave > 4:
-                            if pyxel.rndi(1, 10) < 5:
+                            if rng.rndi(rng.STREAM_SPAWN, 1, 10) < 5:
                                 spawn_enemy = 'ENEMY_BIG'
                                 game.game.cam_shake_timer = 0.1
-                        obj = Obj(pos=obj.get_pos(), **game_object.ALL_OBJECTS[spawn_enemy])
-                        game.game.objects.append(obj)
+                        obj = game_object.pool.acquire(obj.get_pos(), **game_object.ALL_OBJECTS[spawn_enemy])
+                        game.game.add_object(obj)
                         game.game.action = game.Action.MoveEnemy
                         game.game.selected_enemy = obj
                         game.game.new_wave_enemies -= 1
@@ -266,35 +352,212 @@ def update():
             elif obj.obj_type in [ObjType.EnemyDead]:
                 if obj.move_timer < constants.MOVE_ANIM_TIME:
                     obj.move_timer += constants.FRAME_TIME
-                    obj.pos_x = interp.interp(obj.move_start_pos[0], obj.target_pos[0], obj.move_timer, constants.MOVE_ANIM_TIME, interp.EasingType.EaseOutCubic)
-                    obj.pos_y = interp.interp(obj.move_start_pos[1], obj.target_pos[1], obj.move_timer, constants.MOVE_ANIM_TIME, interp.EasingType.EaseOutCubic)
+                    knocked_back.append(obj)
+
+        # Corpses don't collide, nothing else this frame depends on where they are so they're all moved at once
+        if knocked_back:
+            starts = np.array([obj.move_start_pos for obj in knocked_back], dtype=float)
+            targets = np.array([obj.target_pos for obj in knocked_back], dtype=float)
+            timers = np.array([obj.move_timer for obj in knocked_back], dtype=float).reshape(-1, 1)
+            positions = interp.interp_array(starts, targets, timers, constants.MOVE_ANIM_TIME, interp.EasingType.EaseOutCubic)
+            for obj, (pos_x, pos_y) in zip(knocked_back, positions.tolist()):
+                obj.pos_x = pos_x
+                obj.pos_y = pos_y
 
         #
         # Frame state reset
         #
         for obj in destroy_list:
-            if obj in game.game.objects:
-                game.game.objects.remove(obj)
+            if obj.world is game.game:
+                game.game.remove_object(obj)
+                if obj.obj_type in game.POOLED_TYPES:
+                    game_object.pool.release(obj)
+
+
+def update_ui():
+    """ Clicks and key presses on the UI and the board, draw() only renders their state"""
+    if constants.ALLOW_UNDO and Controls.mouse_cancel() and game.game.game_state == game.GameState.Game:
+        if turn_journal.undo(game.game):
+            return
+
+    #
+    # Actions
+    #
+    for die, pos_x, pos_y in get_action_buttons():
+        if Controls.mouse_in(pos_x-5, pos_y-4, 30, 14):
+            if game.game.can_do_die_action(die):
+                turn_journal.record(game.game)
+            game.game.take_dice(die)
+    pos_x, pos_y = get_unstuck_button()
+    if Controls.mouse_in(pos_x-5, pos_y-4, 30, 14):
+        if game.game.is_any_die_stuck():
+            game.game.start_new_wave()
+
+    #
+    # Dice
+    #
+    for i, (pos_x, pos_y) in enumerate(get_dice_positions()):
+        if Controls.mouse_in(pos_x-8, pos_y-22, 29, 31) or Controls.key(i):
+            if game.game.can_roll(i):
+                turn_journal.record(game.game)
+            game.game.roll_die(i)
+
+    if game.game.action == game.Action.MovePlayer:
+        player_cell = game.game.player_obj.get_cell()
+        for x, y, draw_pos in get_player_move_options():
+            if Controls.mouse_in(draw_pos[0], draw_pos[1], constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE):
+                turn_journal.record(game.game)
+                game.game.player_obj.last_move_dir = pyxel.sgn(x)
+                game.game.player_obj.pos_x = draw_pos[0]
+                game.game.player_obj.pos_y = draw_pos[1]
+                game.game.player_obj.movement -= 1
+                if game.game.player_obj.movement <= 0:
+                    game.game.set_action(game.Action.Roll)
+                    game.game.player_obj.movement = game.game.player_obj.max_movement
+                picked_cell = player_cell[0] + x, player_cell[1] + y
+                for obj in sorted(game.game.get_objs_in_cell(*picked_cell), key=lambda o: o.uid):
+                    if obj.obj_type == ObjType.Shotgun:
+                        game.game.do_slide_text("Found Shotgun!")
+                        obj.destroy = True
+                        game.game.player_obj.has_shotgun = True
+                        game.game.player_obj.max_shots = 3
+                        game.game.player_obj.shots = 3
+                    if obj.obj_type == ObjType.Speed:
+                        game.game.do_slide_text("Improved Movement!")
+                        obj.destroy = True
+                        game.game.player_obj.max_movement = 4
+                        game.game.player_obj.movement = 4
+                    if obj.obj_type == ObjType.Health:
+                        game.game.do_slide_text("Health & Ammo!")
+                        obj.destroy = True
+                        game.game.player_obj.start_health = 3
+                        game.game.player_obj.health = 3
+                        game.game.player_obj.max_ammo = 5
+                        game.game.player_obj.ammo = 5
+                resources.play_sound(resources.SOUND_MOVE)
+                break
+    elif game.game.action == game.Action.MoveEnemy:
+        if game.game.selected_enemy is None:
+            for obj in game.game.get_objs_of_type(ObjType.Enemy):
+                if Controls.mouse_in(obj.pos_x, obj.pos_y, constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE):
+                    game.game.selected_enemy = obj
+                    break
+        else:
+            obj = game.game.selected_enemy
+            for x, draw_pos, obj_at_pos in get_enemy_move_options(obj):
+                if Controls.mouse_in(draw_pos[0], draw_pos[1], constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE):
+                    turn_journal.record(game.game)
+                    game.game.selected_enemy.last_move_dir = pyxel.sgn(x)
+                    game.game.selected_enemy = None
+                    action = game.Action.Roll
+                    if obj_at_pos is not None:
+                        if obj_at_pos.obj_type == ObjType.Player:
+                            game.game.player_obj.health -= 1
+                            game.game.player_obj.hit_frames = 12
+                            if game.game.player_obj.health <= 0:
+                                game.game.game_over()
+                            else:
+                                action = game.Action.MovePlayer
+                        elif obj_at_pos.obj_type == ObjType.Target:
+                            game.game.game_over()
+                        elif obj_at_pos.obj_type in [ObjType.Enemy, ObjType.EnemyBig]:
+                            action = game.Action.MoveEnemy
+                            game.game.selected_enemy = obj_at_pos
+
+                    obj.move_start_pos = obj.get_pos()
+                    obj.target_pos = draw_pos
+                    obj.move_timer = 0
+
+                    resources.play_sound(resources.SOUND_MOVE)
+                    if action != game.Action.MoveEnemy:
+                        game.game.action = action
+                    break
+    elif game.game.action == game.Action.Break:
+        pos_x, pos_y = get_next_wave_button()
+        if Controls.mouse_in(pos_x-8, pos_y-5, 48, 14):
+            game.game.unpause_game()
+
+
+def get_action_buttons() -> List[Tuple[game.Dice, int, int]]:
+    pos_x = game.game.camera_x + constants.GRID_CELL_SIZE - 2
+    pos_y = game.game.camera_y + constants.ROOM_SIZE_PIXELS_Y + constants.HALF_GRID_CELL + 5
+    return [(game.Dice.Move, pos_x, pos_y),
+            (game.Dice.Shoot, pos_x, pos_y + constants.GRID_CELL_SIZE),
+            (game.Dice.Reload, pos_x + constants.GRID_CELL_SIZE*2, pos_y)]
+
+
+def get_unstuck_button() -> Tuple[int, int]:
+    pos_x = game.game.camera_x + constants.GRID_CELL_SIZE - 2 + constants.GRID_CELL_SIZE*2
+    pos_y = game.game.camera_y + constants.ROOM_SIZE_PIXELS_Y + constants.HALF_GRID_CELL + 5 + constants.GRID_CELL_SIZE
+    return pos_x, pos_y
+
+
+def get_dice_positions() -> List[Tuple[int, int]]:
+    pos_x = constants.GRID_CELL_SIZE * 6 - 2
+    pos_y = game.game.camera_y+constants.ROOM_SIZE_PIXELS_Y + constants.GRID_CELL_SIZE*2 - 3
+    return [(pos_x + i*constants.GRID_CELL_SIZE*2, pos_y) for i in range(len(game.game.dice))]
+
+
+def get_next_wave_button() -> Tuple[int, int]:
+    return constants.SCREEN_WIDTH - 48, constants.SCREEN_HEIGHT - constants.GRID_CELL_SIZE - 2
+
+
+def get_player_move_options():
+    """ Neighbouring cells the player can step into, as (x, y, draw_pos)"""
+    player_pos = game.game.player_obj.pos_x, game.game.player_obj.pos_y
+    player_cell = game.game.player_obj.get_cell()
+    options = []
+    for x in range(-1, 2):
+        for y in range(-1, 2):
+            if x == 0 and y == 0:
+                continue
+            if room.is_cell_available(player_cell[0]+x, player_cell[1]+y):
+                draw_pos = player_pos[0] + x*constants.GRID_CELL_SIZE, player_pos[1] + y*constants.GRID_CELL_SIZE
+                options.append((x, y, draw_pos))
+    return options
+
+
+def get_enemy_move_options(obj):
+    """ Cells the enemy is allowed to move to (towards the burger), as (x, draw_pos, obj_at_pos)"""
+    enemy_pos = obj.pos_x, obj.pos_y
+    enemy_cell = obj.get_cell()
+    options = []
+    for x in range(-1, 2):
+        for y in range(-1, 2):
+            if x == 0 and y == 0:
+                continue
+            if not room.is_path_acceptable(enemy_cell, (enemy_cell[0] + x, enemy_cell[1] + y)):
+                continue
+            if game.game.tiles.is_solid(enemy_cell[0] + x, enemy_cell[1] + y):
+                continue
+            obj_at_pos = room.get_obj_at_pos(enemy_cell[0] + x, enemy_cell[1] + y)
+            if obj_at_pos is None or not obj_at_pos.collides or obj_at_pos.obj_type in [ObjType.Enemy, ObjType.EnemyBig, ObjType.Player, ObjType.Target]:
+                draw_pos = enemy_pos[0] + x*constants.GRID_CELL_SIZE, enemy_pos[1] + y*constants.GRID_CELL_SIZE
+                options.append((x, draw_pos, obj_at_pos))
+    return options
 
 
 def draw():
-    if game.game.stop_frames > 0:
-        game.game.stop_frames -= 1
+    if frame_stopped:
         return
 
     pyxel.cls(resources.COLOR_BACKGROUND)
-    #
-    # Sort draw list
-    #
-    draw_list = []
-    for obj in game.game.objects:
-        draw_list.append(obj)
-    draw_list.sort(key=lambda x: x.draw_priority)
+    # Walls and floors come from the prebuilt layer
+    if static_layer.layer.dirty:
+        static_layer.layer.build(game.game.tiles, game.game.objects)
+    static_layer.layer.draw(game.game.camera_x, game.game.camera_y)
+    if constants.DEBUG_DRAW:
+        view = game.game.camera_x, game.game.camera_y, game.game.camera_x + constants.SCREEN_WIDTH, game.game.camera_y + constants.SCREEN_HEIGHT
+        for bbox in game.game.tiles.get_solid_boxes(view).tolist():
+            pyxel.rectb(bbox[0], bbox[1], bbox[2]-bbox[0], bbox[3]-bbox[1], resources.COLOR_BACKGROUND)
 
     #
-    # Render
+    # Render, buckets kept by the game are already in draw order
     #
-    for obj in draw_list:
+    for obj in game.game.get_objs_in_draw_order(room.get_visible_rooms()):
+        # Debug drawing still needs the bounding boxes of baked objects
+        if static_layer.layer.is_baked(obj) and not constants.DEBUG_DRAW:
+            continue
         if obj.hit_frames > 0:
             resources.flip_colors()
 
@@ -319,7 +582,6 @@ def draw():
                 pyxel.rectb(bbox[0], bbox[1], bbox[2]-bbox[0], bbox[3]-bbox[1], resources.COLOR_BACKGROUND)
 
         if obj.hit_frames > 0:
-            obj.hit_frames -= 1
             resources.reset_color()
 
     # Draw UI
@@ -334,6 +596,10 @@ def draw():
         pyxel.rect(pos_x, pos_y, *rect_size, 4)
         pyxel.rectb(pos_x, pos_y, *rect_size, resources.COLOR_TEXT_INACTIVE)
         pyxel.text(pos_x+4, pos_y+4, f"Action: {game.game.action.name}", resources.COLOR_TEXT_INACTIVE)
+        if constants.DEBUG_DRAW:
+            path = game.game.get_path()
+            path_text = f"Path rebuild: {path.last_build_time*1000:.2f}ms"
+            pyxel.text(pos_x+4, pos_y+rect_size[1]+4, path_text, resources.COLOR_TEXT_INACTIVE)
 
     pos_x = game.game.camera_x
     pos_y = game.game.camera_y+constants.ROOM_SIZE_PIXELS_Y-constants.GRID_CELL_SIZE
@@ -344,41 +610,24 @@ def draw():
     #
     pos_x += constants.SCREEN_WIDTH/2 + 5
     pos_y += constants.HALF_GRID_CELL + 2
-    resources.bold_text(pos_x, pos_y, f"{int(game.game.wave_timer)}")
-    pos_x = game.game.camera_x
-    pos_y = game.game.camera_y+constants.ROOM_SIZE_PIXELS_Y
-
+    text_cache.bold_text(pos_x, pos_y, f"{int(game.game.wave_timer)}")
     #
     # Actions
     #
-    pos_x += constants.GRID_CELL_SIZE - 2
-    pos_y += constants.HALF_GRID_CELL + 5
-    def draw_action_button(die, x, y):
+    for die, pos_x, pos_y in get_action_buttons():
         if game.game.can_do_die_action(die):
-            pyxel.text(x, y, die.name, resources.COLOR_TEXT)
+            pyxel.text(pos_x, pos_y, die.name, resources.COLOR_TEXT)
         else:
-            pyxel.text(x, y, die.name, resources.COLOR_TEXT_INACTIVE)
-        if Controls.mouse_in(x-5, y-4, 30, 14):
-            game.game.take_dice(die)
-
-    draw_action_button(game.Dice.Move, pos_x, pos_y)
-    pos_y += constants.GRID_CELL_SIZE
-    draw_action_button(game.Dice.Shoot, pos_x, pos_y)
-    pos_x += constants.GRID_CELL_SIZE*2
-    pos_y -= constants.GRID_CELL_SIZE
-    draw_action_button(game.Dice.Reload, pos_x, pos_y)
-    pos_y += constants.GRID_CELL_SIZE
+            pyxel.text(pos_x, pos_y, die.name, resources.COLOR_TEXT_INACTIVE)
     #
     # Unstuck
     #
+    pos_x, pos_y = get_unstuck_button()
     unstuck_text = "STUCK"
     col = resources.COLOR_TEXT
     if not game.game.is_any_die_stuck():
         col = resources.COLOR_TEXT_INACTIVE
     pyxel.text(pos_x, pos_y, unstuck_text, col)
-    if Controls.mouse_in(pos_x-5, pos_y-4, 30, 14):
-        if game.game.is_any_die_stuck():
-            game.game.start_new_wave()
 
     #
     # Ammo
@@ -396,9 +645,7 @@ def draw():
     #
     # Dice
     #
-    pos_x = constants.GRID_CELL_SIZE * 6 - 2
-    pos_y = game.game.camera_y+constants.ROOM_SIZE_PIXELS_Y + constants.GRID_CELL_SIZE*2 - 3
-    for i in range(len(game.game.dice)):
+    for i, (pos_x, pos_y) in enumerate(get_dice_positions()):
         txt = game.game.get_dice_text(i)
         col = resources.COLOR_TEXT
         if game.game.can_roll(i) == False:
@@ -411,132 +658,43 @@ def draw():
         if img is not None:
             resources.blt_ui_sprite(img,(16,16), pos_x_img, pos_y_img)
 
-        if Controls.mouse_in(pos_x-8, pos_y-22, 29, 31) or Controls.key(i):
-                game.game.roll_die(i)
-
-        pos_x += constants.GRID_CELL_SIZE*2
-
     if game.game.action == game.Action.Roll:
         pass
     elif game.game.action == game.Action.MovePlayer:
-        player_pos = game.game.player_obj.pos_x, game.game.player_obj.pos_y
-        player_cell = game.game.player_obj.get_cell()
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                if x == 0 and y == 0:
-                    continue
-                if room.is_cell_available(player_cell[0]+x, player_cell[1]+y):
-                    draw_pos = player_pos[0] + x*constants.GRID_CELL_SIZE, player_pos[1] + y*constants.GRID_CELL_SIZE
-                    resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE), draw_pos[0], draw_pos[1])
-                    if Controls.mouse_in(draw_pos[0], draw_pos[1], constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE):
-                        game.game.player_obj.last_move_dir = pyxel.sgn(x)
-                        game.game.player_obj.pos_x = draw_pos[0]
-                        game.game.player_obj.pos_y = draw_pos[1]
-                        game.game.player_obj.movement -= 1
-                        if game.game.player_obj.movement <= 0:
-                            game.game.set_action(game.Action.Roll)
-                            game.game.player_obj.movement = game.game.player_obj.max_movement
-                        for obj in game.game.objects:
-                            if obj.get_cell() == (player_cell[0] + x, player_cell[1] + y):
-                                if obj.obj_type == ObjType.Shotgun:
-                                    game.game.do_slide_text("Found Shotgun!")
-                                    obj.destroy = True
-                                    game.game.player_obj.has_shotgun = True
-                                    game.game.player_obj.max_shots = 3
-                                    game.game.player_obj.shots = 3
-                                if obj.obj_type == ObjType.Speed:
-                                    game.game.do_slide_text("Improved Movement!")
-                                    obj.destroy = True
-                                    game.game.player_obj.max_movement = 4
-                                    game.game.player_obj.movement = 4
-                                if obj.obj_type == ObjType.Health:
-                                    game.game.do_slide_text("Health & Ammo!")
-                                    obj.destroy = True
-                                    game.game.player_obj.start_health = 3
-                                    game.game.player_obj.health = 3
-                                    game.game.player_obj.max_ammo = 5
-                                    game.game.player_obj.ammo = 5
-                        resources.play_sound(resources.SOUND_MOVE)
-                        break
+        for x, y, draw_pos in get_player_move_options():
+            resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE), draw_pos[0], draw_pos[1])
     elif game.game.action == game.Action.MoveEnemy:
         if game.game.selected_enemy is None:
-            for obj in game.game.objects:
-                if obj.obj_type == game_object.ObjType.Enemy:
-                    resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE), obj.pos_x, obj.pos_y)
-                    if Controls.mouse_in(obj.pos_x, obj.pos_y, constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE):
-                        game.game.selected_enemy = obj
-                        break
+            for obj in game.game.get_objs_of_type(ObjType.Enemy):
+                resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE), obj.pos_x, obj.pos_y)
         else:
-            obj = game.game.selected_enemy
-            enemy_pos = obj.pos_x, obj.pos_y
-            enemy_cell = obj.get_cell()
-            for x in range(-1, 2):
-                for y in range(-1, 2):
-                    if x == 0 and y == 0:
-                        continue
-                    if not room.is_path_acceptable(enemy_cell, (enemy_cell[0] + x, enemy_cell[1] + y)):
-                        continue
-                    obj_at_pos = room.get_obj_at_pos(enemy_cell[0] + x, enemy_cell[1] + y)
-                    if obj_at_pos is None or not obj_at_pos.collides or obj_at_pos.obj_type in [ObjType.Enemy, ObjType.EnemyBig, ObjType.Player, ObjType.Target]:
-                        draw_pos = enemy_pos[0] + x*constants.GRID_CELL_SIZE, enemy_pos[1] + y*constants.GRID_CELL_SIZE
-                        resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE), draw_pos[0], draw_pos[1])
-                        if Controls.mouse_in(draw_pos[0], draw_pos[1], constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE):
-                            game.game.selected_enemy.last_move_dir = pyxel.sgn(x)
-                            game.game.selected_enemy = None
-                            action = game.Action.Roll
-                            if obj_at_pos is not None:
-                                if obj_at_pos.obj_type == ObjType.Player:
-                                    game.game.player_obj.health -= 1
-                                    game.game.player_obj.hit_frames = 12
-                                    if game.game.player_obj.health <= 0:
-                                        game.game.game_over()
-                                    else:
-                                        action = game.Action.MovePlayer
-                                elif obj_at_pos.obj_type == ObjType.Target:
-                                    game.game.game_over()
-                                elif obj_at_pos.obj_type in [ObjType.Enemy, ObjType.EnemyBig]:
-                                    action = game.Action.MoveEnemy
-                                    game.game.selected_enemy = obj_at_pos
-
-                            obj.move_start_pos = obj.get_pos()
-                            obj.target_pos = draw_pos
-                            obj.move_timer = 0
-
-                            resources.play_sound(resources.SOUND_MOVE)
-                            if action != game.Action.MoveEnemy:
-                                game.game.action = action
-                            break
+            for x, draw_pos, obj_at_pos in get_enemy_move_options(game.game.selected_enemy):
+                resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (constants.GRID_CELL_SIZE, constants.GRID_CELL_SIZE), draw_pos[0], draw_pos[1])
     elif game.game.action == game.Action.Shoot:
         pyxel.circ(game.game.shoot_target[0], game.game.shoot_target[1], 2, resources.COLOR_TEXT)
         pyxel.circ(game.game.shoot_target[0], game.game.shoot_target[1], 1, resources.COLOR_TEXT_INACTIVE)
         pyxel.line(game.game.player_obj.pos_x+8, game.game.player_obj.pos_y+8, game.game.shoot_target[0], game.game.shoot_target[1], resources.COLOR_TEXT_INACTIVE)
     elif game.game.action == game.Action.NewWave:
-        for obj in game.game.objects:
-            if obj.obj_type == ObjType.Spawn:
-                resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (16, 16), obj.pos_x, obj.pos_y)
+        for obj in game.game.get_objs_of_type(ObjType.Spawn):
+            resources.blt_ui_sprite(resources.SPRITE_UI_HIGHLIGHT, (16, 16), obj.pos_x, obj.pos_y)
     elif game.game.action == game.Action.Break:
-        pos_x = constants.SCREEN_WIDTH - 48
-        pos_y = constants.SCREEN_HEIGHT - constants.GRID_CELL_SIZE - 2
-        resources.bold_text(pos_x, pos_y, "NEXT WAVE")
-        if Controls.mouse_in(pos_x-8, pos_y-5, 48, 14):
-            game.game.unpause_game()
+        pos_x, pos_y = get_next_wave_button()
+        text_cache.bold_text(pos_x, pos_y, "NEXT WAVE")
     if game.game.action != game.Action.Break:
         pos_x = constants.SCREEN_WIDTH - 48
         pos_y = constants.SCREEN_HEIGHT - constants.GRID_CELL_SIZE - 2
-        resources.bold_text(pos_x, pos_y, f"Wave: {game.game.current_wave}")
+        text_cache.bold_text(pos_x, pos_y, f"Wave: {game.game.current_wave}")
 
     # Draw path values
-    for x in range(len(game.game.path)):
-        for y in range(len(game.game.path[0])):
-            pos = room.get_pos_for_room(cell_pos=(x, y))
-            pos = pos[0]+8, pos[1]+8
-            if game.game.path[x][y] is not None and Controls.mouse_hovering(x*16, y*16, 16, 16):
-                #pyxel.text(pos[0], pos[1], str(game.game.path[x][y]), resources.COLOR_TEXT_INACTIVE)
-                pyxel.circ(pos[0], pos[1], 2, resources.COLOR_TEXT_INACTIVE)
-                for dx in range(-1, 2):
-                    for dy in range(-1, 2):
-                        if game.game.path[x+dx][y+dy] is not None and game.game.path[x+dx][y+dy] < game.game.path[x][y]:
-                            pyxel.line(x*constants.GRID_CELL_SIZE+8, y*constants.GRID_CELL_SIZE+8, (x+dx)*constants.GRID_CELL_SIZE+8, (y+dy)*constants.GRID_CELL_SIZE+8, resources.COLOR_TEXT_INACTIVE)
+    hover_cell = int(Controls.mouse_x()/constants.GRID_CELL_SIZE), int(Controls.mouse_y()/constants.GRID_CELL_SIZE)
+    path = game.game.get_path()
+    if path.get(hover_cell) != UNREACHABLE and Controls.mouse_hovering(hover_cell[0]*16, hover_cell[1]*16, 16, 16):
+        pos = room.get_pos_for_room(cell_pos=hover_cell)
+        pos = pos[0]+8, pos[1]+8
+        #pyxel.text(pos[0], pos[1], str(path.get(hover_cell)), resources.COLOR_TEXT_INACTIVE)
+        pyxel.circ(pos[0], pos[1], 2, resources.COLOR_TEXT_INACTIVE)
+        for cell in path.get_downhill_cells(hover_cell):
+            pyxel.line(hover_cell[0]*constants.GRID_CELL_SIZE+8, hover_cell[1]*constants.GRID_CELL_SIZE+8, cell[0]*constants.GRID_CELL_SIZE+8, cell[1]*constants.GRID_CELL_SIZE+8, resources.COLOR_TEXT_INACTIVE)
 
     # Tutorial
     if game.game.game_state == game.GameState.Tutorial:
@@ -606,59 +764,37 @@ def draw():
 
     if game.game.player_obj.ammo <= 1:
         if int(pyxel.frame_count / 10) % 3 != 0:
-            resources.bold_text(game.game.player_obj.pos_x - 8, game.game.player_obj.pos_y - 8, "LOW AMMO")
+            text_cache.bold_text(game.game.player_obj.pos_x - 8, game.game.player_obj.pos_y - 8, "LOW AMMO")
 
     x_pos_slide = 38
     y_pos_slide = 24
     if game.game.slide_text_timer > 0:
         x = interp.interp(game.game.camera_x-100, x_pos_slide, 1-game.game.slide_text_timer, 1, interp.EasingType.Slerp)
-        draw_slide_bg(x, y_pos_slide)
-        resources.bold_text(x, y_pos_slide, game.game.slide_text,)
-        game.game.slide_text_timer -= constants.FRAME_TIME
+        slide_banner.draw(x, y_pos_slide)
+        text_cache.bold_text(x, y_pos_slide, game.game.slide_text,)
     elif game.game.slide_text_timer > -1.5:
         if game.game.slide_text_timer < -0.5:
             x = interp.interp( x_pos_slide, game.game.camera_x + pyxel.width+50, abs(game.game.slide_text_timer)-0.5, 1, interp.EasingType.EaseInOutQuint)
-            draw_slide_bg(x, y_pos_slide)
-            resources.bold_text(x, y_pos_slide, game.game.slide_text,)
+            slide_banner.draw(x, y_pos_slide)
+            text_cache.bold_text(x, y_pos_slide, game.game.slide_text,)
         else:
-            draw_slide_bg(x_pos_slide, y_pos_slide)
-            resources.bold_text(x_pos_slide, y_pos_slide, game.game.slide_text, )
-        game.game.slide_text_timer -= constants.FRAME_TIME
+            slide_banner.draw(x_pos_slide, y_pos_slide)
+            text_cache.bold_text(x_pos_slide, y_pos_slide, game.game.slide_text, )
 
     if game.game.action == game.Action.Shoot:
-        resources.bold_text(pyxel.mouse_x, pyxel.mouse_y - 8, f"{game.game.player_obj.shots}/{game.game.player_obj.max_shots}")
+        text_cache.bold_text(Controls.mouse_x(), Controls.mouse_y() - 8, f"{game.game.player_obj.shots}/{game.game.player_obj.max_shots}")
     elif game.game.action == game.Action.MovePlayer:
-        resources.bold_text(pyxel.mouse_x, pyxel.mouse_y - 8, f"{game.game.player_obj.movement}/{game.game.player_obj.max_movement}")
+        text_cache.bold_text(Controls.mouse_x(), Controls.mouse_y() - 8, f"{game.game.player_obj.movement}/{game.game.player_obj.max_movement}")
     elif game.game.action == game.Action.NewWave:
-        resources.bold_text(pyxel.mouse_x, pyxel.mouse_y - 8, f"{game.game.new_wave_enemies}")
+        text_cache.bold_text(Controls.mouse_x(), Controls.mouse_y() - 8, f"{game.game.new_wave_enemies}")
     elif game.game.action == game.Action.MoveEnemy:
-        resources.bold_text(pyxel.mouse_x - 8, pyxel.mouse_y - 12, f"Move an enemy!")
+        text_cache.bold_text(Controls.mouse_x() - 8, Controls.mouse_y() - 12, f"Move an enemy!")
 
     if game.game.game_state == game.GameState.GameOver:
-        score = 'F'
-        if game.game.current_wave > 7:
-            score = 'A+'
-        elif game.game.current_wave > 6:
-            score = 'B+'
-        elif game.game.enemies_killed > 22:
-            score = 'B'
-        elif game.game.enemies_killed > 20:
-            score = 'C+'
-        elif game.game.enemies_killed > 12:
-            score = 'C'
-        elif game.game.current_wave > 4:
-            score = 'D'
-        elif game.game.current_wave > 3:
-            score = 'E'
-        draw_tutorial_message((7, 10), f"  You lost!\n\n\n"
-                                       f"  Wave: {game.game.current_wave}\n\n"
-                                       f"  Enemies killed: {game.game.enemies_killed}\n\n"
-                                       f"  Time Survived: {game.game.total_time}\n\n"
-                                       f"  Score: {score}\n\n\n"
-                                       f"  Click to try again!")
+        draw_tutorial_message((7, 10), get_game_over_text(game.game.current_wave, game.game.enemies_killed, game.game.total_time))
 
     # Mouse cursor
-    resources.blt_ui_sprite(resources.SPRITE_UI_CURSOR, (8, 8), pyxel.mouse_x, pyxel.mouse_y)
+    resources.blt_ui_sprite(resources.SPRITE_UI_CURSOR, (8, 8), Controls.mouse_x(), Controls.mouse_y())
 
 
 
@@ -683,27 +819,45 @@ def draw_tutorial_circle(target_cell):
     pyxel.circb(target_pos[0], target_pos[1], 13, resources.COLOR_TEXT_INACTIVE)
 
 
+@functools.lru_cache(maxsize=4)
+def get_game_over_text(current_wave, enemies_killed, total_time) -> str:
+    score = 'F'
+    if current_wave > 7:
+        score = 'A+'
+    elif current_wave > 6:
+        score = 'B+'
+    elif enemies_killed > 22:
+        score = 'B'
+    elif enemies_killed > 20:
+        score = 'C+'
+    elif enemies_killed > 12:
+        score = 'C'
+    elif current_wave > 4:
+        score = 'D'
+    elif current_wave > 3:
+        score = 'E'
+    return (f"  You lost!\n\n\n"
+            f"  Wave: {current_wave}\n\n"
+            f"  Enemies killed: {enemies_killed}\n\n"
+            f"  Time Survived: {total_time}\n\n"
+            f"  Score: {score}\n\n\n"
+            f"  Click to try again!")
+
+
 def draw_tutorial_message(target_cell, txt):
-    txt_size = utils.get_size_for_text(txt)
+    txt_size = text_cache.get_text_size(txt)
     target_pos_orig = room.get_pos_for_room(target_cell)
     target_pos = target_pos_orig[0] - txt_size[0]/2, target_pos_orig[1] - txt_size[1] - 16
     if target_pos[0] < 16:
         target_pos = 16, target_pos[1]
     if target_pos[0]+txt_size[0] > constants.SCREEN_WIDTH:
         target_pos = constants.SCREEN_WIDTH - txt_size[0]-8, target_pos[1]
-    pyxel.rect(target_pos[0]-4, target_pos[1]-4, txt_size[0]+8, txt_size[1]+8, 4)
-    pyxel.rectb(target_pos[0]-4, target_pos[1]-4, txt_size[0]+8, txt_size[1]+8, 5)
-    pyxel.text(target_pos[0], target_pos[1], txt, resources.COLOR_TEXT_INACTIVE)
-
-def draw_slide_bg(x_pos, y_pos):
-    for y in range(-10, 10):
-        n = pyxel.noise((y_pos + y*2) / 20, pyxel.frame_count / 30) * 10
-        pyxel.line(x_pos, y_pos + y, x_pos + 96 + n, y_pos+ y, 4)
-        n = pyxel.noise((y_pos + y*2) / 20, (pyxel.frame_count+5) / 30)*10
-        pyxel.line(x_pos-40, y_pos + y, x_pos + 52 + n, y_pos+ y, 5)
-        n = pyxel.noise((y_pos + y*2) / 20, (pyxel.frame_count+10) / 30)*10
-        pyxel.line(x_pos - 46 + n, y_pos + y, x_pos - 16 + n, y_pos+ y, 6)
-
-
-init()
-pyxel.run(update, draw)
+    text_cache.panel(target_pos[0], target_pos[1], txt)
+
+
+if __name__ == "__main__":
+    init()
+    if constants.REPLAY_INPUT_FILE:
+        pyxel.run(update_replay, draw)
+    else:
+        pyxel.run(update, draw)
@@ -0,0 +1,144 @@
+import bisect
+import pickle
+import struct
+import zlib
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple
+
+import constants
+from controls import InputFrame
+
+# File layout: header, then tagged chunks. Input chunks are runs of identical frames (frame count, mouse x, mouse y,
+# held keys, pressed keys), keyframe chunks hold the compressed game state before a given frame.
+# Closing the recorder appends an index of the keyframes and a footer pointing at it.
+MAGIC = b"GJIN"
+VERSION = 3
+HEADER = struct.Struct("<4sBQ")
+TAG_INPUT = b"I"
+TAG_KEYFRAME = b"K"
+TAG_INDEX = b"X"
+RUN = struct.Struct("<HhhII")
+KEYFRAME = struct.Struct("<II")  # Frame, size of the state that follows
+INDEX_ENTRY = struct.Struct("<IQ")  # Frame, offset of the keyframe chunk
+FOOTER = struct.Struct("<Q4s")
+FOOTER_MAGIC = b"GJIX"
+MAX_RUN = 0xFFFF
+
+
+def pack_state(state: Any) -> bytes:
+    return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def unpack_state(data: bytes) -> Any:
+    return pickle.loads(zlib.decompress(data))
+
+
+class InputRecorder:
+    """
+    Streams input frames to a file, repeated frames (idle mouse) are stored once with a count.
+    With get_state given, a keyframe of the game state is stored every KEYFRAME_INTERVAL frames.
+    """
+    def __init__(self, path: str, seed: int, get_state: Callable[[], Any] = None):
+        self.file: BinaryIO = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed))
+        self.get_state = get_state
+        self.run_frame: InputFrame = None
+        self.run_length = 0
+        self.frame_count = 0
+        self.keyframes: List[Tuple[int, int]] = []  # (frame, offset)
+
+    def add(self, frame: InputFrame) -> None:
+        # Called before the frame is applied, so a keyframe here is the state this frame starts from
+        if self.get_state is not None and self.frame_count % constants.KEYFRAME_INTERVAL == 0:
+            self._write_run()
+            self._write_keyframe()
+        self.frame_count += 1
+        if frame == self.run_frame and self.run_length < MAX_RUN:
+            self.run_length += 1
+            return
+        self._write_run()
+        self.run_frame = frame
+        self.run_length = 1
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self._write_run()
+        index_offset = self.file.tell()
+        self.file.write(TAG_INDEX + struct.pack("<I", len(self.keyframes)))
+        for frame, offset in self.keyframes:
+            self.file.write(INDEX_ENTRY.pack(frame, offset))
+        self.file.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        self.file.close()
+
+    def _write_run(self) -> None:
+        if self.run_length > 0:
+            self.file.write(TAG_INPUT + RUN.pack(self.run_length, *self.run_frame))
+            self.run_length = 0
+
+    def _write_keyframe(self) -> None:
+        state = pack_state(self.get_state())
+        self.keyframes.append((self.frame_count, self.file.tell()))
+        self.file.write(TAG_KEYFRAME + KEYFRAME.pack(self.frame_count, len(state)))
+        self.file.write(state)
+
+
+class InputLog:
+    """ A recorded run: its seed, the input of every update and where its keyframes are"""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        magic, version, self.seed = HEADER.unpack_from(self.data, 0)
+        assert magic == MAGIC, f"{path} is not an input log"
+        assert version == VERSION, f"Unsupported input log version {version}"
+        self.frames: List[InputFrame] = []
+        self.keyframes: List[Tuple[int, int]] = []  # (frame, offset), sorted by frame
+        self._read_chunks()
+
+    def _read_chunks(self) -> None:
+        pos = HEADER.size
+        end = len(self.data)
+        has_index = False
+        if end >= HEADER.size + FOOTER.size:
+            index_offset, footer_magic = FOOTER.unpack_from(self.data, end - FOOTER.size)
+            if footer_magic == FOOTER_MAGIC:
+                has_index = True
+                end = index_offset
+                count = struct.unpack_from("<I", self.data, index_offset + 1)[0]
+                for i in range(count):
+                    self.keyframes.append(INDEX_ENTRY.unpack_from(self.data, index_offset + 5 + i*INDEX_ENTRY.size))
+
+        # Input runs sit between keyframes, keyframe states are skipped over without being read
+        while pos < end:
+            tag = self.data[pos:pos+1]
+            pos += 1
+            if tag == TAG_INPUT and pos + RUN.size <= end:
+                run_length, *values = RUN.unpack_from(self.data, pos)
+                self.frames.extend([InputFrame(*values)] * run_length)
+                pos += RUN.size
+            elif tag == TAG_KEYFRAME and pos + KEYFRAME.size <= end:
+                frame, size = KEYFRAME.unpack_from(self.data, pos)
+                if pos + KEYFRAME.size + size > end:
+                    break
+                if not has_index:
+                    # Recorder wasn't closed, find the keyframes the slow way
+                    self.keyframes.append((frame, pos - 1))
+                pos += KEYFRAME.size + size
+            else:
+                # Cut off mid chunk, keep what was complete
+                break
+
+    def get_keyframe(self, frame: int) -> Optional[Tuple[int, Any]]:
+        """ Latest keyframe at or before the frame, as (keyframe frame, state)"""
+        i = bisect.bisect_right(self.keyframes, (frame, len(self.data))) - 1
+        if i < 0:
+            return None
+        key_frame, offset = self.keyframes[i]
+        _, size = KEYFRAME.unpack_from(self.data, offset + 1)
+        start = offset + 1 + KEYFRAME.size
+        return key_frame, unpack_state(self.data[start:start+size])
+
+
+def load_input_log(path: str) -> Tuple[int, List[InputFrame]]:
+    """ Returns the seed the run was recorded with and its input, one entry per update"""
+    log = InputLog(path)
+    return log.seed, log.frames
@@ -8,6 +8,8 @@ SPRITE_SIZE = 16
 
 IMAGE_SPRITES = 0
 IMAGE_UI = 1
+IMAGE_TEXT_CACHE = 2  # Not in the resource file, text_cache draws into it
+TEXT_CACHE_HEIGHT = 152  # Rows of IMAGE_TEXT_CACHE for text, slide_banner bakes into the ones below
 
 SPRITE_BG = (0, 0)
 SPRITE_BGB = (1, 0)
@@ -0,0 +1,63 @@
+import random
+from typing import Dict, Tuple
+
+# One stream per subsystem, so extra rolls in one of them don't shift the others
+STREAM_DICE = "dice"
+STREAM_SPAWN = "spawn"
+STREAM_ENEMY = "enemy"
+STREAM_BULLETS = "bullets"
+STREAM_CAMERA = "camera"  # Cosmetic only, kept apart from the game logic streams
+
+
+class RandomStreams:
+    def __init__(self, seed: int = 0):
+        self.seed_value = seed
+        self.streams: Dict[str, random.Random] = {}
+
+    def seed(self, seed: int) -> None:
+        self.seed_value = seed
+        self.streams.clear()
+
+    def get(self, name: str) -> random.Random:
+        stream = self.streams.get(name)
+        if stream is None:
+            # String seeds are hashed the same way on every run and platform
+            stream = random.Random(f"{self.seed_value}:{name}")
+            self.streams[name] = stream
+        return stream
+
+    def getstate(self) -> Tuple[int, Dict[str, tuple]]:
+        """ Seed and the state of every stream drawn from so far, the others still start from the seed"""
+        return self.seed_value, {name: stream.getstate() for name, stream in self.streams.items()}
+
+    def setstate(self, state: Tuple[int, Dict[str, tuple]]) -> None:
+        self.seed_value, stream_states = state
+        self.streams.clear()
+        for name, stream_state in stream_states.items():
+            stream = random.Random()
+            stream.setstate(stream_state)
+            self.streams[name] = stream
+
+
+streams = RandomStreams()
+
+
+def seed(seed_value: int = None) -> int:
+    """ Reseeds every stream, a new seed is picked when none is given. Returns the seed in use"""
+    if seed_value is None:
+        seed_value = random.randrange(2**32)
+    streams.seed(seed_value)
+    return seed_value
+
+
+def get_seed() -> int:
+    return streams.seed_value
+
+
+def rndi(stream: str, a: int, b: int) -> int:
+    """ Inclusive on both ends like pyxel.rndi"""
+    return streams.get(stream).randint(min(a, b), max(a, b))
+
+
+def rndf(stream: str, a: float, b: float) -> float:
+    return streams.get(stream).uniform(a, b)
@@ -1,8 +1,11 @@
 import math
-from typing import Tuple
+from typing import List, Tuple
+
+import numpy as np
 
 from constants import *
-from game_object import ObjType
+from flow_field import UNREACHABLE
+from game_object import ObjType, obj_blocks_path
 import game
 
 
@@ -24,6 +27,16 @@ def get_pos_from_room_coords(room_coords: Tuple[int, int]) -> Tuple[int, int]:
     return pos
 
 
+def get_visible_rooms(margin: int = GRID_CELL_SIZE) -> List[Tuple[int, int]]:
+    """ Rooms the screen overlaps, the margin covers camera shake and sprites reaching past their cell"""
+    room_width, room_height = get_pos_from_room_coords((1, 1))
+    x0 = math.floor((game.game.camera_x - margin) / room_width)
+    y0 = math.floor((game.game.camera_y - margin) / room_height)
+    x1 = math.floor((game.game.camera_x + SCREEN_WIDTH + margin) / room_width)
+    y1 = math.floor((game.game.camera_y + SCREEN_HEIGHT + margin) / room_height)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
 def move_camera_to_new_room(room_coords: Tuple[int, int]) -> None:
     game.camera_target_x, game.camera_target_y = get_pos_from_room_coords(room_coords)
     game.camera_move_timer = 0
@@ -34,49 +47,52 @@ def get_current_room() -> Tuple[int, int]:
 
 
 def get_obj_at_pos(x, y):
-    for obj in game.game.objects:
+    # Walls are in the tile grid, this only looks at objects
+    # Cells hold only a handful of objects, pick the earliest added one like a scan of the object list would
+    found = None
+    for obj in game.game.get_objs_in_cell(x, y):
         if obj.collides == True:
-            if obj.get_cell() == (x, y):
-                return obj
-    return None
+            if found is None or obj.uid < found.uid:
+                found = obj
+    return found
 def is_cell_available(x, y):
-    return get_obj_at_pos(x, y) is None
+    if game.game.tiles.is_solid(x, y):
+        return False
+    for obj in game.game.get_objs_in_cell(x, y):
+        if obj.collides == True:
+            return False
+    return True
 
 def get_dist_to_player(x, y):
     player = game.game.player_obj
     return abs(player.pos_x - x) + abs(player.pos_y - y)
 
 
-def floodfill(start_pos: Tuple[int, int]):
-    open_list = [start_pos]
-
-    for pos in open_list:
-        if 0 > pos[0] > len(game.game.path):
-            continue
-        if 0 > pos[1] > len(game.game.path[0]):
+def get_path_walkable_mask() -> np.ndarray:
+    walkable = ~game.game.tiles.solid
+    for cell, objs in game.game.occupancy.items():
+        if not (0 <= cell[0] < MAP_SIZE_X and 0 <= cell[1] < MAP_SIZE_Y):
             continue
-        val = game.game.path[pos[0]][pos[1]]
-        if val is None:
-            val = 0
-            game.game.path[pos[0]][pos[1]] = val
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                if x == 0 and y == 0:
-                    continue
-                if game.game.path[pos[0]+x][pos[1]+y] is None:
-                    if is_cell_available(pos[0]+x, pos[1]+y):
-                        game.game.path[pos[0] + x][pos[1] + y] = val + 1
-                        open_list.append((pos[0]+x, pos[1]+y))
+        for obj in objs:
+            if obj_blocks_path(obj):
+                walkable[cell] = False
+                break
+    return walkable
+
+
+def init_path_fields():
+    game.game.path_fields.set_map(get_path_walkable_mask())
+
+
+def get_path_dist_to(obj, cell: Tuple[int, int]) -> int:
+    return game.game.get_path_dist(game.get_path_field_key(obj), cell)
+
 
 def is_path_acceptable(from_pos, to_pos) -> bool:
-    if 0 > to_pos[0] > len(game.game.path):
-        return False
-    if 0 > to_pos[1] > len(game.game.path[0]):
-        return False
-    val_from = game.game.path[from_pos[0]][from_pos[1]]
-    val_to = game.game.path[to_pos[0]][to_pos[1]]
-    if val_from is None:
+    val_from = game.game.get_path_dist(game.PATH_FIELD_BURGER, from_pos)
+    val_to = game.game.get_path_dist(game.PATH_FIELD_BURGER, to_pos)
+    if val_from == UNREACHABLE:
         val_from = 999
-    if val_to is None:
+    if val_to == UNREACHABLE:
         return False
     return val_to < val_from
@@ -0,0 +1,346 @@
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import constants
+import game
+import resources
+import rng
+import snapshot
+from flow_field import FlowFieldCache
+from game_object import Obj, ObjType
+from tile_grid import TileGrid
+
+# python -c "import headless; sim = headless.Simulation(); import savegame; print(savegame.benchmark(sim.game))"
+# python -c "import headless, balance; sim = headless.Simulation(3); p = balance.GreedyPolicy(3); [(p.act(sim), sim.step()) for _ in range(2500)]; import savegame; print(savegame.check_round_trip(sim.game))"
+
+# File layout, little endian:
+#   header, game record, dice, action queue, string table,
+#   tile grid layers (tile id per cell), walkable layer, entity records, random streams
+MAGIC = b"GJSV"
+VERSION = 3
+# Magic, version, map size x, map size y, tile layers, dice, queued actions, entities, random seed, random streams
+HEADER = struct.Struct("<4sBHHBHHIqB")
+GAME = struct.Struct("<BBHIiiIIIIiiB4i9dHH")
+DIE = struct.Struct("<Bd")  # Face, roll timer
+ENTITY = struct.Struct("<IBHHHBbbhhI5d4i4hBB8h")
+STREAM = struct.Struct("<HB625IBd")  # Name, Mersenne Twister version, state words and position, has gauss_next, gauss_next
+NO_STRING = 0xFFFF
+NO_UID = -1
+
+# Game attributes stored as ints and as doubles, in GAME order
+GAME_INTS = ["camera_x", "camera_y", "camera_target_x", "camera_target_y"]
+GAME_FLOATS = ["time_since_tutorial_step", "total_time", "cam_shake_timer", "wave_timer", "shoot_time", "shoot_target",
+               "slide_text_timer", "time_since_game_over"]
+# Attributes only some object types have, stored with a mask of which ones are there
+OBJ_STATS = ["start_health", "health", "max_ammo", "ammo", "max_movement", "movement", "max_shots", "shots"]
+OBJ_FLAG_COLLIDES = 1
+OBJ_FLAG_DESTROY = 2
+OBJ_FLAG_HAS_SHOTGUN = 4
+
+
+class SaveGameError(Exception):
+    """ The file isn't a save game this version can read: another format, an older version or cut short"""
+
+
+def _sprite_key(sprite):
+    # Animated sprites are lists of frames
+    return tuple(sprite) if type(sprite) is list else sprite
+
+
+SPRITE_NAMES: Dict = {}
+for _name in sorted(dir(resources)):
+    if _name.startswith("SPRITE_"):
+        SPRITE_NAMES.setdefault(_sprite_key(getattr(resources, _name)), _name)
+
+
+class StringTable:
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def add(self, text: Optional[str]) -> int:
+        if text is None:
+            return NO_STRING
+        i = self.ids.get(text)
+        if i is None:
+            i = len(self.strings)
+            self.strings.append(text)
+            self.ids[text] = i
+        return i
+
+    def pack(self) -> bytes:
+        data = [struct.pack("<H", len(self.strings))]
+        for text in self.strings:
+            encoded = text.encode()
+            data.append(struct.pack("<H", len(encoded)) + encoded)
+        return b"".join(data)
+
+
+def _get_int_mask(values) -> int:
+    # Timers and positions start out as ints and turn float once they move, a bit per double keeps which it was
+    return sum(1 << i for i, val in enumerate(values) if type(val) is int)
+
+
+def _restore_ints(values, int_mask: int) -> List:
+    return [int(val) if int_mask & (1 << i) else val for i, val in enumerate(values)]
+
+
+def _get_velocity(obj: Obj) -> Tuple[float, float]:
+    # Bullets hold their direction repeated BULLET_SPEED times, only the first pair is ever read
+    return obj.velocity[0], obj.velocity[1]
+
+
+def _pack_entity(obj: Obj, strings: StringTable) -> bytes:
+    flags = (OBJ_FLAG_COLLIDES if obj.collides else 0) | (OBJ_FLAG_DESTROY if obj.destroy else 0) | (OBJ_FLAG_HAS_SHOTGUN if obj.has_shotgun else 0)
+    floats = (obj.pos_x, obj.pos_y, *_get_velocity(obj), obj.move_timer)
+    stats_mask = 0
+    stats = []
+    for i, stat in enumerate(OBJ_STATS):
+        if hasattr(obj, stat):
+            stats_mask |= 1 << i
+        stats.append(int(getattr(obj, stat, 0)))
+    return ENTITY.pack(obj.uid, obj.obj_type.value, strings.add(obj.name), strings.add(SPRITE_NAMES[_sprite_key(obj.sprite)]),
+                       strings.add(obj.text), flags, int(obj.last_move_dir), int(obj.draw_priority), int(obj.hit_frames),
+                       int(obj.anim_speed), int(obj.last_input_frame),
+                       *floats, *obj.move_start_pos, *obj.target_pos, *obj.bounding_box, _get_int_mask(floats),
+                       stats_mask, *stats)
+
+
+def _unpack_entity(values: Tuple, strings: List[str]) -> Obj:
+    uid, obj_type, name, sprite, text, flags, last_move_dir, draw_priority, hit_frames, anim_speed, last_input_frame = values[:11]
+    floats = _restore_ints(values[11:16], values[24])
+    bounding_box = values[20:24]
+    stats_mask = values[25]
+    obj = Obj.__new__(Obj)
+    obj.world = None
+    obj.uid = uid
+    obj._pos_x, obj._pos_y = floats[0], floats[1]
+    obj._cell = obj._calc_cell()
+    obj.name = strings[name]
+    obj.obj_type = ObjType(obj_type)
+    obj.sprite = getattr(resources, strings[sprite])
+    obj.collides = flags & OBJ_FLAG_COLLIDES != 0
+    obj.last_input_frame = last_input_frame
+    obj.text = strings[text] if text != NO_STRING else None
+    obj.velocity = floats[2], floats[3]
+    obj.destroy = flags & OBJ_FLAG_DESTROY != 0
+    obj.has_shotgun = flags & OBJ_FLAG_HAS_SHOTGUN != 0
+    obj.last_move_dir = last_move_dir
+    obj.move_start_pos = values[16], values[17]
+    obj.target_pos = values[18], values[19]
+    obj.move_timer = floats[4]
+    obj.hit_frames = hit_frames
+    obj.bounding_box = bounding_box
+    obj.draw_priority = draw_priority
+    obj.anim_speed = anim_speed
+    for i, stat in enumerate(OBJ_STATS):
+        if stats_mask & (1 << i):
+            setattr(obj, stat, values[26 + i])
+    return obj
+
+
+def _pack_stream(name: str, stream_state: tuple, strings: StringTable) -> bytes:
+    version, words, gauss_next = stream_state
+    return STREAM.pack(strings.add(name), version, *words, gauss_next is not None, gauss_next or 0.0)
+
+
+def _unpack_stream(values: Tuple, strings: List[str]) -> Tuple[str, tuple]:
+    has_gauss_next, gauss_next = values[-2:]
+    return strings[values[0]], (values[1], values[2:-2], gauss_next if has_gauss_next else None)
+
+
+def save(g: game.Game, path: str, streams: rng.RandomStreams = None) -> int:
+    """ Writes the game and the random streams (rng.streams unless given) to path, returns the file size"""
+    seed, stream_states = (streams or rng.streams).getstate()
+    strings = StringTable()
+    ref = lambda obj: obj.uid if obj is not None else NO_UID
+    floats = []
+    for key in GAME_FLOATS:
+        val = getattr(g, key)
+        floats.extend(val if type(val) is tuple else (val,))
+    game_record = GAME.pack(g.game_state.value, g.action.value, g.tutorial_step, g.next_uid, ref(g.player_obj), ref(g.selected_enemy),
+                            g.enemies_killed, g.count_bullets, g.count_enemies_d, g.current_wave, g.new_wave_enemies,
+                            g.stop_frames, g.path_fields.ready, *(getattr(g, key) for key in GAME_INTS), *floats,
+                            _get_int_mask(floats), strings.add(g.slide_text))
+    dice = b"".join(DIE.pack(die.value, timer) for die, timer in zip(g.dice, g.dice_roll_timer))
+    actions = bytes(action.value for action in g.action_queue)
+    entity_records = b"".join(_pack_entity(obj, strings) for obj in g.objects)
+    stream_records = b"".join(_pack_stream(name, state, strings) for name, state in stream_states.items())
+
+    # Written next to the save and swapped in, a crash while saving leaves the last save as it was
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, constants.MAP_SIZE_X, constants.MAP_SIZE_Y, len(g.tiles.ids), len(g.dice),
+                            len(g.action_queue), len(g.objects), seed, len(stream_states)))
+        f.write(game_record)
+        f.write(dice)
+        f.write(actions)
+        f.write(strings.pack())
+        f.write(g.tiles.ids.tobytes())
+        f.write(g.path_fields.walkable.astype(np.uint8).tobytes())
+        f.write(entity_records)
+        f.write(stream_records)
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def load(path: str, level: game.Game = None, streams: rng.RandomStreams = None) -> game.Game:
+    """
+    Reads a game written by save(). When level is a game with the same tiles (usually the freshly loaded level),
+    its tile grid is shared instead of being created again. The saved random streams are restored into streams when
+    it's given.
+    Raises SaveGameError when the file can't be read as a save game.
+    """
+    try:
+        return _read(path, level, streams)
+    except (ValueError, IndexError, AttributeError, UnicodeDecodeError, struct.error) as e:
+        # Empty files can't be mapped, cut off records fail to unpack, damaged ones name unknown sprites and states
+        raise SaveGameError(f"{path} is damaged: {e}") from e
+
+
+def _read(path: str, level: Optional[game.Game], streams: Optional[rng.RandomStreams]) -> game.Game:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        (magic, version, size_x, size_y, tile_layers, dice_count, action_count, entity_count, seed,
+         stream_count) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise SaveGameError(f"{path} is not a save game")
+        if version != VERSION:
+            raise SaveGameError(f"Unsupported save game version {version} in {path}")
+        pos = HEADER.size
+        game_values = GAME.unpack_from(data, pos)
+        pos += GAME.size
+        dice = [DIE.unpack_from(data, pos + i*DIE.size) for i in range(dice_count)]
+        pos += dice_count*DIE.size
+        actions = data[pos:pos+action_count]
+        pos += action_count
+        strings = []
+        for _ in range(struct.unpack_from("<H", data, pos)[0]):
+            pos += 2
+            length = struct.unpack_from("<H", data, pos)[0]
+            strings.append(data[pos+2:pos+2+length].decode())
+            pos += length
+        pos += 2
+        cells = size_x*size_y
+        if len(data) != pos + (tile_layers + 1)*cells + entity_count*ENTITY.size + stream_count*STREAM.size:
+            raise SaveGameError(f"{path} has the wrong size for its header, it was cut short or written over")
+
+        # Layers are read in place, copies are only made of what the game keeps
+        tile_ids = np.frombuffer(data, dtype=np.uint8, count=tile_layers*cells, offset=pos).reshape((tile_layers, size_x, size_y))
+        pos += tile_layers*cells
+        walkable = np.frombuffer(data, dtype=np.uint8, count=cells, offset=pos).reshape((size_x, size_y)).astype(bool)
+        pos += cells
+        with memoryview(data) as view:
+            objects = [_unpack_entity(values, strings) for values in ENTITY.iter_unpack(view[pos:pos+entity_count*ENTITY.size])]
+            pos += entity_count*ENTITY.size
+            stream_states = dict(_unpack_stream(values, strings) for values in STREAM.iter_unpack(view[pos:]))
+        if level is not None and np.array_equal(level.tiles.ids, tile_ids):
+            tiles = level.tiles
+        else:
+            tiles = TileGrid(size_x, size_y)
+            tiles.set_ids(tile_ids)
+        # Views into the map have to be gone before it's closed
+        del tile_ids
+
+    g = game.Game.__new__(game.Game)
+    (game_state, action, g.tutorial_step, g.next_uid, player_uid, selected_uid, g.enemies_killed, g.count_bullets,
+     g.count_enemies_d, g.current_wave, g.new_wave_enemies, g.stop_frames, path_ready) = game_values[:13]
+    g.game_state = game.GameState(game_state)
+    g.action = game.Action(action)
+    for key, val in zip(GAME_INTS, game_values[13:17]):
+        setattr(g, key, val)
+    floats = _restore_ints(game_values[17:-2], game_values[-2])
+    i = 0
+    for key in GAME_FLOATS:
+        if key == "shoot_target":
+            g.shoot_target = floats[i], floats[i+1]
+            i += 2
+        else:
+            setattr(g, key, floats[i])
+            i += 1
+    g.slide_text = strings[game_values[-1]]
+    g.dice = [game.Dice(face) for face, _ in dice]
+    g.dice_roll_timer = [timer for _, timer in dice]
+    g.action_queue = [game.Action(action) for action in actions]
+
+    g.tiles = tiles
+    g.change_log = None
+    g.objects = dict.fromkeys(objects)
+    g.rebuild_cell_index()
+    by_uid = {}
+    g.path_fields = FlowFieldCache(size_x, size_y)
+    for obj in objects:
+        obj.world = g
+        by_uid[obj.uid] = obj
+        if obj.obj_type in game.PATH_FIELD_TYPES:
+            g.path_fields.set_target(game.get_path_field_key(obj), obj.get_cell())
+    g.player_obj = by_uid.get(player_uid)
+    g.selected_enemy = by_uid.get(selected_uid)
+    g.path_fields.walkable[:] = walkable
+    g.path_fields.ready = bool(path_ready)
+    if streams is not None:
+        streams.setstate((seed, stream_states))
+    return g
+
+
+def benchmark(g: game.Game, path: str = "benchmark.sav", repeats: int = 20) -> Dict[str, float]:
+    """ File size and average seconds per save and load, next to pickling the same game"""
+    import pickle
+    import time
+
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeats):
+        results["size"] = save(g, path)
+    results["save"] = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        load(path)
+    results["load"] = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        load(path, level=g)
+    results["load_with_level"] = (time.perf_counter() - start) / repeats
+
+    data = pickle.dumps(g, protocol=pickle.HIGHEST_PROTOCOL)
+    results["pickle_size"] = len(data)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pickle.loads(data)
+    results["pickle_load"] = (time.perf_counter() - start) / repeats
+    os.remove(path)
+    return results
+
+
+def check_round_trip(g: game.Game, path: str = "check.sav") -> List[str]:
+    """ Saves and loads the game, returns what came back different. Empty when the round trip is exact"""
+    loaded_streams = rng.RandomStreams()
+    save(g, path)
+    loaded = load(path, streams=loaded_streams)
+    os.remove(path)
+    problems = []
+    # Compared by repr so an int coming back as float counts too
+    if repr(rng.streams.getstate()) != repr(loaded_streams.getstate()):
+        problems.append("random streams")
+    fields, loaded_fields = snapshot.get_game_fields(g), snapshot.get_game_fields(loaded)
+    for key in fields.keys() | loaded_fields.keys():
+        val, loaded_val = fields.get(key), loaded_fields.get(key)
+        if key == "tiles":
+            val, loaded_val = val.ids.tolist(), loaded_val.ids.tolist()
+        if repr(val) != repr(loaded_val):
+            problems.append(f"game.{key}: {val!r} != {loaded_val!r}")
+    if not np.array_equal(g.path_fields.walkable, loaded.path_fields.walkable):
+        problems.append("path_fields.walkable")
+    if [obj.uid for obj in g.objects] != [obj.uid for obj in loaded.objects]:
+        problems.append("object uids or order")
+    for obj, loaded_obj in zip(g.objects, loaded.objects):
+        state, loaded_state = obj.get_state(), loaded_obj.get_state()
+        state["velocity"] = _get_velocity(obj)
+        for key in state.keys() | loaded_state.keys():
+            if repr(state.get(key)) != repr(loaded_state.get(key)):
+                problems.append(f"{obj.obj_type.name} {obj.uid}.{key}: {state.get(key)!r} != {loaded_state.get(key)!r}")
+    return problems
@@ -0,0 +1,62 @@
+import math
+from typing import Tuple
+
+import pyxel
+
+import constants
+import resources
+
+ROWS = 20  # Banner height, centered on the slide text
+PHASES = 60  # The ends wobble in a loop of this many frames
+EDGE_WIDTH = 21  # Ragged end of a band, it moves up to 10 pixels either way
+EDGES_PER_ROW = 256 // EDGE_WIDTH
+# Baked ends only use these two colors, drawing maps them to the band color or leaves them out
+COLOR_FILL = 1
+COLOR_EMPTY = 2
+
+
+def to_pixel(x: float) -> int:
+    # Same as pyxel does with coordinates, rounds half away from zero
+    return int(math.copysign(math.floor(abs(x) + 0.5), x))
+
+
+def get_edge_region(phase: int) -> Tuple[int, int]:
+    """ u, v of the baked band end of the phase, below the text in the text cache image"""
+    return (phase % EDGES_PER_ROW) * EDGE_WIDTH, resources.TEXT_CACHE_HEIGHT + (phase // EDGES_PER_ROW) * ROWS
+
+
+def bake() -> None:
+    """ Draws the band end of every phase, call when the image bank was overwritten"""
+    image = pyxel.image(resources.IMAGE_TEXT_CACHE)
+    # Noise is sampled around a circle so the loop closes, as fast along it as the wobble used to move through time
+    radius = PHASES / constants.FPS / (2*math.pi)
+    for phase in range(PHASES):
+        u, v = get_edge_region(phase)
+        angle = 2*math.pi * phase / PHASES
+        image.rect(u, v, EDGE_WIDTH, ROWS, COLOR_EMPTY)
+        for row in range(ROWS):
+            offset = pyxel.noise((row - ROWS//2) / 10, radius*math.cos(angle), radius*math.sin(angle)) * 10
+            end = min(max(to_pixel(EDGE_WIDTH//2 + offset), 0), EDGE_WIDTH - 1)
+            image.rect(u, v + row, end + 1, 1, COLOR_FILL)
+
+
+def blt_edge(x, y, frame: int, col: int, inverted: bool = False) -> None:
+    """ Band end of the frame in col, filled from its left side. Inverted fills from the right side up to the edge"""
+    u, v = get_edge_region(frame % PHASES)
+    shown, hidden = (COLOR_EMPTY, COLOR_FILL) if inverted else (COLOR_FILL, COLOR_EMPTY)
+    pyxel.pal(shown, col)
+    pyxel.blt(x, y, resources.IMAGE_TEXT_CACHE, u, v, EDGE_WIDTH, ROWS, colkey=hidden)
+    pyxel.pal(shown, shown)
+
+
+def draw(x, y) -> None:
+    """ Three bands behind the slide text at (x, y), each a rect with baked ends. The bands run 5 frames apart"""
+    top = y - ROWS//2
+    frame = pyxel.frame_count
+    pyxel.rect(x, top, 86, ROWS, 4)
+    blt_edge(x + 86, top, frame, 4)
+    pyxel.rect(x - 40, top, 82, ROWS, 5)
+    blt_edge(x + 42, top, frame + 5, 5)
+    blt_edge(x - 57, top, frame + 10, 6, inverted=True)
+    pyxel.rect(x - 36, top, 10, ROWS, 6)
+    blt_edge(x - 26, top, frame + 10, 6)
@@ -0,0 +1,112 @@
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+
+import game
+from flow_field import FlowFieldCache
+from game_object import Obj, ObjType
+
+# python -c "import headless; sim = headless.Simulation(); import snapshot; print(snapshot.benchmark(sim.game))"
+
+# Level objects nothing ever changes after loading, snapshots share them instead of copying.
+# Walls and floors are in the game's tile grid, which is shared as a whole
+STATIC_TYPES = [ObjType.Spawn, ObjType.Target]
+
+# Game fields holding objects, stored as uids and looked up again on restore
+OBJ_REF_FIELDS = ["player_obj", "selected_enemy"]
+# Game fields rebuilt on restore rather than copied
+REBUILT_FIELDS = ["objects", "occupancy", "draw_buckets", "by_type", "colliders", "path_fields", "change_log"] + OBJ_REF_FIELDS
+
+
+class GameSnapshot:
+    """ State of a Game frozen at one point in time, restore() can be called on it any number of times"""
+    def __init__(self, fields: Dict[str, Any], obj_refs: Dict[str, int], objects: List[Union[Obj, Dict[str, Any]]],
+                 path_walkable: np.ndarray, path_targets: Dict[str, Tuple[int, int]], path_ready: bool):
+        self.fields = fields
+        self.obj_refs = obj_refs
+        self.objects = objects  # Static objects by reference, everything else as a copy of its attributes
+        self.path_walkable = path_walkable
+        self.path_targets = path_targets
+        self.path_ready = path_ready
+
+
+def get_game_fields(g: game.Game) -> Dict[str, Any]:
+    """ Game attributes besides the object list and what's derived from it, object references as uids"""
+    fields = {}
+    for key, val in g.__dict__.items():
+        if key in REBUILT_FIELDS:
+            continue
+        # Game only holds flat lists (dice, timers, queued actions) next to immutable values
+        fields[key] = list(val) if type(val) is list else val
+    for key in OBJ_REF_FIELDS:
+        obj = getattr(g, key)
+        fields[key] = obj.uid if obj is not None else None
+    return fields
+
+
+def get_obj_state(obj: Obj) -> Dict[str, Any]:
+    return obj.get_state()
+
+
+def take(g: game.Game) -> GameSnapshot:
+    fields = get_game_fields(g)
+    obj_refs = {key: fields.pop(key) for key in OBJ_REF_FIELDS}
+    objects = [obj if obj.obj_type in STATIC_TYPES else get_obj_state(obj) for obj in g.objects]
+    cache = g.path_fields
+    return GameSnapshot(fields, obj_refs, objects, cache.walkable.copy(), dict(cache.targets), cache.ready)
+
+
+def restore(snapshot: GameSnapshot) -> game.Game:
+    g = game.Game.__new__(game.Game)
+    for key, val in snapshot.fields.items():
+        g.__dict__[key] = list(val) if type(val) is list else val
+
+    g.change_log = None
+    g.objects = {}
+    by_uid = {}
+    for entry in snapshot.objects:
+        if type(entry) is dict:
+            obj = Obj.__new__(Obj)
+            obj.set_state(entry)
+        else:
+            obj = entry
+        obj.world = g
+        g.objects[obj] = None
+        by_uid[obj.uid] = obj
+    g.rebuild_cell_index()
+    for key, uid in snapshot.obj_refs.items():
+        setattr(g, key, by_uid[uid] if uid is not None else None)
+
+    # Distance fields are rebuilt lazily from the saved map and targets, only when something asks for them
+    g.path_fields = FlowFieldCache(*snapshot.path_walkable.shape)
+    g.path_fields.walkable[:] = snapshot.path_walkable
+    g.path_fields.targets = dict(snapshot.path_targets)
+    g.path_fields.ready = snapshot.path_ready
+    return g
+
+
+def benchmark(g: game.Game, repeats: int = 20) -> Dict[str, float]:
+    """ Average seconds per checkpoint and per restore, for deepcopy and for snapshots"""
+    import time
+    from copy import deepcopy
+
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeats):
+        checkpoint = deepcopy(g)
+    results["deepcopy_take"] = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        deepcopy(checkpoint)
+    results["deepcopy_restore"] = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        snap = take(g)
+    results["snapshot_take"] = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        restore(snap)
+    results["snapshot_restore"] = (time.perf_counter() - start) / repeats
+    return results
+
@@ -0,0 +1,123 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pyxel
+
+import constants
+import resources
+import snapshot
+from game_object import Obj
+from tile_grid import TileGrid
+
+# Tilemap 0 is the level as made in the editor, baked layers use the ones after it
+FIRST_TILEMAP = 1
+TILEMAP_COUNT = 8
+TILE_SIZE = 8
+TILEMAP_SIZE = 256  # In tiles
+SPRITE_TILES = resources.SPRITE_SIZE // TILE_SIZE
+
+
+def find_empty_tile() -> Optional[Tuple[int, int]]:
+    """ A sprite sheet tile drawn fully transparent, used for cells with nothing baked in them"""
+    image = pyxel.image(resources.IMAGE_SPRITES)
+    tiles = image.width // TILE_SIZE, image.height // TILE_SIZE
+    # Unused space is usually at the end of the sheet
+    for ty in reversed(range(tiles[1])):
+        for tx in reversed(range(tiles[0])):
+            if all(image.pget(tx*TILE_SIZE + x, ty*TILE_SIZE + y) == resources.COLOR_BACKGROUND
+                   for y in range(TILE_SIZE) for x in range(TILE_SIZE)):
+                return tx, ty
+    return None
+
+
+def can_bake(obj: Obj) -> bool:
+    return (type(obj.sprite) is tuple and obj.text is None and obj.last_move_dir >= 0 and
+            obj.pos_x % constants.GRID_CELL_SIZE == 0 and obj.pos_y % constants.GRID_CELL_SIZE == 0 and
+            can_bake_cell(obj.get_cell()))
+
+
+def can_bake_cell(cell: Tuple[int, int]) -> bool:
+    size = TILEMAP_SIZE*TILE_SIZE // constants.GRID_CELL_SIZE
+    return 0 <= cell[0] < size and 0 <= cell[1] < size
+
+
+class StaticLayer:
+    """
+    Level pieces that never change, baked into spare tilemaps and drawn with one bltm per layer.
+    The tile grid goes in first, then the static objects. Sprites stacked in one cell go to successive layers.
+    Everything else is drawn on top of them.
+    """
+    def __init__(self):
+        self.dirty = True
+        self.layer_count = 0
+        self.baked: Set[Obj] = set()
+        self.empty_tile: Optional[Tuple[int, int]] = None
+        self.loose_tiles: List[Tuple[Tuple[int, int], Tuple[int, int]]] = []  # (cell, sprite) of tiles that couldn't be baked
+
+    def invalidate(self) -> None:
+        """ Call when the level objects were replaced, the layer is rebuilt on the next draw"""
+        self.dirty = True
+
+    def build(self, tiles: TileGrid, objects: Iterable[Obj]) -> None:
+        self.dirty = False
+        self.layer_count = 0
+        self.baked = set()
+        self.loose_tiles = []
+        self.empty_tile = find_empty_tile()
+
+        depth: Dict[Tuple[int, int], int] = {}
+        # Grid layers are already in draw order
+        for layer, cell, sprite in tiles.get_tiles():
+            if (self.empty_tile is None or type(sprite) is not tuple or not can_bake_cell(cell) or
+                    depth.get(cell, 0) != layer or layer >= TILEMAP_COUNT - FIRST_TILEMAP):
+                # Tiles have no object to draw them, the layer draws them one by one
+                self.loose_tiles.append((cell, sprite))
+                depth[cell] = TILEMAP_COUNT
+                continue
+            self._bake_sprite(layer, cell, sprite)
+            depth[cell] = layer + 1
+        if self.empty_tile is None:
+            return
+
+        # Same order draw() would use, so stacked sprites keep their order
+        for obj in sorted(objects, key=lambda o: o.draw_priority):
+            if obj.obj_type not in snapshot.STATIC_TYPES:
+                continue
+            cell = obj.get_cell()
+            layer = depth.get(cell, 0)
+            if not can_bake(obj) or layer >= TILEMAP_COUNT - FIRST_TILEMAP:
+                # Whatever is drawn above an object left out can't be baked either
+                depth[cell] = TILEMAP_COUNT
+                continue
+            self._bake_sprite(layer, cell, obj.sprite)
+            depth[cell] = layer + 1
+            self.baked.add(obj)
+
+    def _bake_sprite(self, layer: int, cell: Tuple[int, int], sprite: Tuple[int, int]) -> None:
+        tilemap = pyxel.tilemap(FIRST_TILEMAP + layer)
+        if layer == self.layer_count:
+            tilemap.image = pyxel.image(resources.IMAGE_SPRITES)
+            tilemap.cls(self.empty_tile)
+            self.layer_count += 1
+        tx, ty = cell[0]*SPRITE_TILES, cell[1]*SPRITE_TILES
+        for x in range(SPRITE_TILES):
+            for y in range(SPRITE_TILES):
+                tilemap.pset(tx + x, ty + y, (sprite[0]*SPRITE_TILES + x, sprite[1]*SPRITE_TILES + y))
+
+    def is_baked(self, obj: Obj) -> bool:
+        return obj in self.baked
+
+    def draw(self, camera_x: int, camera_y: int) -> None:
+        # A cell of margin around the screen covers camera shake
+        x = max(0, camera_x - constants.GRID_CELL_SIZE)
+        y = max(0, camera_y - constants.GRID_CELL_SIZE)
+        width = constants.SCREEN_WIDTH + constants.GRID_CELL_SIZE*2
+        height = constants.SCREEN_HEIGHT + constants.GRID_CELL_SIZE*2
+        for i in range(self.layer_count):
+            pyxel.bltm(x, y, FIRST_TILEMAP + i, x, y, width, height, colkey=resources.COLOR_BACKGROUND)
+        for cell, sprite in self.loose_tiles:
+            pos_x, pos_y = cell[0]*constants.GRID_CELL_SIZE, cell[1]*constants.GRID_CELL_SIZE
+            if x <= pos_x < x + width and y <= pos_y < y + height:
+                resources.blt_sprite(sprite, pos_x, pos_y)
+
+
+layer = StaticLayer()
@@ -0,0 +1,124 @@
+import functools
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import pyxel
+
+import resources
+import utils
+
+STYLE_BOLD = "bold"  # resources.bold_text
+STYLE_PANEL = "panel"  # Tutorial message box
+
+ROW_HEIGHT = 8  # One line of bold text
+# Not drawn by any style, marks the pixels blt leaves out
+COLOR_KEY = 7
+COLOR_PANEL = 4
+COLOR_PANEL_BORDER = 5
+
+# Sizes of the same few strings are asked for every frame
+get_text_size = functools.lru_cache(maxsize=256)(utils.get_size_for_text)
+
+Region = Tuple[int, int, int, int]  # u, v, width, height in the image
+
+
+def get_size(text: str, style: str) -> Tuple[int, int]:
+    width, height = get_text_size(text)
+    if style == STYLE_BOLD:
+        # Outline reaches one pixel around the text
+        return width + 2, height + 2
+    return width + 8, height + 8
+
+
+def render(image, y: int, text: str, style: str) -> None:
+    """ Draws the text in the style into the image, top left at (0, y)"""
+    width, height = get_size(text, style)
+    if style == STYLE_BOLD:
+        image.rect(0, y, width, height, COLOR_KEY)
+        for dx, dy in [(-1, 0), (0, -1), (1, 0), (0, 1)]:
+            image.text(1 + dx, y + 1 + dy, text, resources.COLOR_HIGHLIGHT)
+        image.text(1, y + 1, text, resources.COLOR_BACKGROUND)
+    else:
+        image.rect(0, y, width, height, COLOR_PANEL)
+        image.rectb(0, y, width, height, COLOR_PANEL_BORDER)
+        image.text(4, y + 4, text, resources.COLOR_TEXT_INACTIVE)
+
+
+class TextCache:
+    """
+    Text drawn once into a spare image bank and blitted from there. Each entry takes as many full width rows as its
+    height needs, the least recently used entries make room for new ones.
+    """
+    def __init__(self, image: int = resources.IMAGE_TEXT_CACHE, height: int = resources.TEXT_CACHE_HEIGHT):
+        self.image = image
+        self.height = height  # Rows of the image from the top that are used
+        self.entries: OrderedDict = OrderedDict()  # (text, style) -> (first row, row count, Region), least recently used first
+        self.rows: List[bool] = []  # Rows taken by an entry
+
+    def clear(self) -> None:
+        """ Call when the image bank was overwritten"""
+        self.entries.clear()
+        self.rows = [False] * (self.height // ROW_HEIGHT)
+
+    def get(self, text: str, style: str) -> Optional[Region]:
+        """ Where the text is in the image, drawn there first if needed. None when it doesn't fit at all"""
+        key = text, style
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry[2]
+
+        image = pyxel.image(self.image)
+        width, height = get_size(text, style)
+        count = -(-height // ROW_HEIGHT)
+        if width > image.width:
+            return None
+        row = self._allocate(count)
+        if row is None:
+            return None
+        self.rows[row:row+count] = [True] * count
+        render(image, row*ROW_HEIGHT, text, style)
+        region = 0, row*ROW_HEIGHT, width, height
+        self.entries[key] = row, count, region
+        return region
+
+    def _allocate(self, count: int) -> Optional[int]:
+        if not self.rows:
+            self.clear()
+        if count > len(self.rows):
+            return None
+        while True:
+            free = 0
+            for row, taken in enumerate(self.rows):
+                free = 0 if taken else free + 1
+                if free == count:
+                    return row - count + 1
+            if not self.entries:
+                return None
+            _, (row, taken, _) = self.entries.popitem(last=False)
+            self.rows[row:row+taken] = [False] * taken
+
+
+cache = TextCache()
+
+
+def bold_text(x, y, text: str) -> None:
+    region = cache.get(text, STYLE_BOLD)
+    if region is None:
+        resources.bold_text(x, y, text)
+        return
+    u, v, width, height = region
+    pyxel.blt(x - 1, y - 1, cache.image, u, v, width, height, colkey=COLOR_KEY)
+
+
+def panel(x, y, text: str) -> None:
+    """ Text in a message box, the text itself starts at (x, y)"""
+    region = cache.get(text, STYLE_PANEL)
+    if region is None:
+        width, height = get_text_size(text)
+        pyxel.rect(x - 4, y - 4, width + 8, height + 8, COLOR_PANEL)
+        pyxel.rectb(x - 4, y - 4, width + 8, height + 8, COLOR_PANEL_BORDER)
+        pyxel.text(x, y, text, resources.COLOR_TEXT_INACTIVE)
+        return
+    u, v, width, height = region
+    pyxel.blt(x - 4, y - 4, cache.image, u, v, width, height)
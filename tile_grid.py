@@ -0,0 +1,64 @@
+from typing import Iterator, Tuple
+
+import numpy as np
+
+import constants
+from game_object import ALL_OBJECTS, ObjType
+
+# Level geometry, kept in the grid instead of the object list
+TILE_TYPES = [ObjType.Background, ObjType.Wall]
+# Tile id is the index of the ALL_OBJECTS key here plus one, 0 is an empty slot
+TILE_KEYS = [key for key, params in ALL_OBJECTS.items() if params["obj_type"] in TILE_TYPES]
+NO_TILE = 0
+TILE_SPRITES = [None] + [ALL_OBJECTS[key]["sprite"] for key in TILE_KEYS]
+# Same as the objects they stand for, floors can be walked over and walls block
+TILE_COLLIDES = [False] + [ALL_OBJECTS[key]["obj_type"] == ObjType.Wall for key in TILE_KEYS]
+
+
+class TileGrid:
+    """
+    Walls and floors of the level, as the ids of the tiles stacked in each cell plus which cells are solid.
+    Tiles are added while the level loads and never change after, games copied from one another share the grid.
+    """
+    def __init__(self, size_x: int, size_y: int):
+        self.ids = np.zeros((1, size_x, size_y), dtype=np.uint8)  # Layer, x, y, layers drawn in order
+        self.solid = np.zeros((size_x, size_y), dtype=bool)
+
+    def add_tile(self, key: str, cell: Tuple[int, int]) -> None:
+        """ Puts the ALL_OBJECTS tile on top of the ones already in the cell"""
+        tile_id = TILE_KEYS.index(key) + 1
+        layer = int(np.count_nonzero(self.ids[:, cell[0], cell[1]]))
+        if layer == len(self.ids):
+            self.ids = np.concatenate((self.ids, np.zeros((1,) + self.solid.shape, dtype=np.uint8)))
+        self.ids[layer, cell[0], cell[1]] = tile_id
+        self.solid[cell] |= TILE_COLLIDES[tile_id]
+
+    def set_ids(self, ids: np.ndarray) -> None:
+        """ Replaces all tiles with the (layer, x, y) array of ids"""
+        self.ids = np.array(ids, dtype=np.uint8)
+        self.solid = np.array(TILE_COLLIDES)[self.ids].any(axis=0)
+
+    def is_solid(self, x: int, y: int) -> bool:
+        if not (0 <= x < self.solid.shape[0] and 0 <= y < self.solid.shape[1]):
+            return False
+        return bool(self.solid[x, y])
+
+    def get_tiles(self) -> Iterator[Tuple[int, Tuple[int, int], Tuple[int, int]]]:
+        """ Every tile as (layer, cell, sprite), layer by layer"""
+        for layer, ids in enumerate(self.ids):
+            xs, ys = np.nonzero(ids)
+            for x, y, tile_id in zip(xs.tolist(), ys.tolist(), ids[xs, ys].tolist()):
+                yield layer, (x, y), TILE_SPRITES[tile_id]
+
+    def get_solid_boxes(self, bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """ World space boxes of the solid cells the bbox could overlap, as an (N, 4) array"""
+        x0 = max(0, int(bbox[0] // constants.GRID_CELL_SIZE))
+        y0 = max(0, int(bbox[1] // constants.GRID_CELL_SIZE))
+        x1 = min(self.solid.shape[0] - 1, int(bbox[2] // constants.GRID_CELL_SIZE))
+        y1 = min(self.solid.shape[1] - 1, int(bbox[3] // constants.GRID_CELL_SIZE))
+        if x1 < x0 or y1 < y0:
+            return np.zeros((0, 4))
+        xs, ys = np.nonzero(self.solid[x0:x1+1, y0:y1+1])
+        xs = (xs + x0) * constants.GRID_CELL_SIZE
+        ys = (ys + y0) * constants.GRID_CELL_SIZE
+        return np.stack((xs, ys, xs + constants.GRID_CELL_SIZE, ys + constants.GRID_CELL_SIZE), axis=1).astype(float)